@@ -2,7 +2,7 @@ import os, re, json, mimetypes
 
 import frappe
 from pypika import Order
-from .permissions import get_user_access, user_has_permission
+from .permissions import get_user_access, user_has_permission, check_access_many
 from pathlib import Path
 from werkzeug.wrappers import Response
 from werkzeug.utils import secure_filename, send_file
@@ -15,8 +15,9 @@ from drive.utils.files import (
     get_file_type,
     get_new_title,
     update_file_size,
-    if_folder_exists,
+    create_folder_tree,
     FileManager,
+    create_thumbnail_from_bucket,
 )
 from datetime import date, timedelta
 import magic
@@ -28,6 +29,19 @@ from io import BytesIO
 from werkzeug.wrappers import Response
 from werkzeug.wsgi import wrap_file
 from drive.locks.distributed_lock import DistributedLock
+from drive.utils.cache import bump_generation, bump_folder_generation, bump_entity_parent
+from drive.utils.recents import remove_recents as remove_user_recents
+from drive.utils.ancestors import get_ancestors
+from drive.utils import blobs
+from drive.utils.uploads import (
+    HASH_BLOCK_SIZE,
+    PART_URL_BATCH_SIZE,
+    S3_MAX_PARTS,
+    UPLOAD_CHUNK_SIZE,
+    UploadSession,
+    get_file_hash,
+    get_received_ranges,
+)
 
 
 @frappe.whitelist()
@@ -49,9 +63,18 @@ def upload_file(team, personal=None, fullpath=None, parent=None, last_modified=N
     embed = int(embed)
 
     if fullpath:
-        dirname = os.path.dirname(fullpath).split("/")
-        for i in dirname:
-            parent = if_folder_exists(team, i, parent, is_private)
+        dirname = "/".join(p for p in os.path.dirname(fullpath).split("/") if p)
+        folders = create_folder_tree(team, parent, is_private, [dirname], create=False)
+        if not folders:
+            if not user_has_permission(parent, "upload"):
+                frappe.throw("Ask the folder owner for upload access.", frappe.PermissionError)
+            # Same lock as `create_upload_folders`, so that the two don't create duplicate
+            # folders. It is only taken when folders are missing, and released right away rather
+            # than held while the chunk is written.
+            frappe.db.sql("SELECT name FROM `tabDrive File` WHERE name = %s FOR UPDATE", parent)
+            folders = create_folder_tree(team, parent, is_private, [dirname])
+            frappe.db.commit()
+        parent = folders[dirname]
 
     if not user_has_permission(parent, 'upload'):
         frappe.throw("Ask the folder owner for upload access.", frappe.PermissionError)
@@ -63,31 +86,157 @@ def upload_file(team, personal=None, fullpath=None, parent=None, last_modified=N
         frappe.throw("You're out of storage!", ValueError)
 
     file = frappe.request.files["file"]
-    upload_session = frappe.form_dict.uuid
-    title = get_new_title(frappe.form_dict.filename if embed else file.filename, parent)
+    upload_session = UploadSession(frappe.form_dict.uuid)
     current_chunk = int(frappe.form_dict.chunk_index)
     total_chunks = int(frappe.form_dict.total_chunk_count)
+    if not 0 <= current_chunk < total_chunks:
+        frappe.throw("Invalid chunk index.", ValueError)
 
-    temp_path = get_upload_path(home_folder["name"], f"{upload_session}_{secure_filename(title)}")
-    with temp_path.open("ab") as f:
-        f.seek(int(frappe.form_dict.chunk_byte_offset))
-        f.write(file.stream.read())
-        if (
-            not f.tell() >= int(frappe.form_dict.total_file_size)
-            or current_chunk != total_chunks - 1
-        ):
-            return
+    # A chunk retried after the upload was finalized
+    if name := upload_session.get_file():
+        return frappe.get_doc("Drive File", name)
+
+    # Chunks can arrive in any order, so the temp file only depends on the upload
+    filename = frappe.form_dict.filename if embed else file.filename
+    temp_path = get_upload_path(
+        home_folder["name"], f"{frappe.form_dict.uuid}_{secure_filename(filename)}"
+    )
+    session = upload_session.get()
+    if session:
+        if session.get("upload_id"):
+            frappe.throw("This upload is sent straight to storage.", ValueError)
+        if session.owner != frappe.session.user:
+            frappe.throw("This upload was started by someone else.", frappe.PermissionError)
+        if session.file_size != int(frappe.form_dict.total_file_size):
+            frappe.throw("The file size does not match the upload session.", ValueError)
+    data = file.stream.read()
+    manager = FileManager()
+    # Parts streamed to S3 are never read back, so they can only be hashed block by block
+    if manager.s3_enabled and int(frappe.form_dict.chunk_size) % HASH_BLOCK_SIZE:
+        frappe.throw("Chunks must be a multiple of 4 MiB when uploading to S3.", ValueError)
+    upload_session.create(
+        "" if manager.s3_enabled else temp_path,
+        frappe.form_dict.total_file_size,
+        frappe.form_dict.chunk_size,
+        total_chunks,
+        team=team,
+        parent=parent,
+        filename=filename,
+        # The other chunks are streamed to S3 before the file can be sniffed
+        mime_type=(
+            magic.from_buffer(data[:2048], mime=True)
+            if manager.s3_enabled and current_chunk == 0
+            else None
+        ),
+    )
+    if manager.s3_enabled:
+        # Chunks are forwarded as the parts of a multipart upload, nothing is staged on disk
+        multipart = start_multipart_upload(upload_session, manager, home_folder, filename, embed)
+        etag = manager.upload_part(multipart.s3_key, multipart.upload_id, current_chunk + 1, data)
+        upload_session.add_part(current_chunk + 1, etag, len(data))
+    else:
+        upload_session.write_chunk(temp_path, int(frappe.form_dict.chunk_byte_offset), data)
+    upload_session.add_digests(current_chunk, frappe.form_dict.chunk_size, data)
+    if not upload_session.mark_received(current_chunk, total_chunks):
+        return
+    # Another request completing at the same time is already finalizing
+    if not upload_session.acquire_finalize_lock():
+        return
+
+    try:
+        hashes = get_upload_hashes(
+            upload_session,
+            total_chunks,
+            None if manager.s3_enabled else temp_path,
+            session and session.get("content_hash"),
+        )
+        if manager.s3_enabled:
+            drive_file = finalize_s3_upload(
+                team,
+                is_private,
+                parent,
+                upload_session,
+                filename,
+                last_modified,
+                embed,
+                manager,
+                hashes,
+            )
+        else:
+            drive_file = finalize_upload(
+                team,
+                is_private,
+                parent,
+                home_folder,
+                temp_path,
+                filename,
+                last_modified,
+                embed,
+                hashes,
+            )
+    except Exception:
+        upload_session.release_finalize_lock()
+        raise
+    frappe.db.after_commit.add(lambda: upload_session.set_file(drive_file.name))
+    return drive_file
+
+
+def get_upload_hashes(upload_session, total_chunks, temp_path=None, expected=None):
+    """
+    Return the content hash and fast hash of a complete upload, from the digests of its chunks,
+    or by reading the temp file back if its chunks were not aligned on blocks
+
+    :param expected: Content hash the client announced when creating the upload session
+    :raises ValueError: If the upload does not match the announced content hash
+    """
+    hashes = upload_session.get_content_hash(total_chunks)
+    if not hashes and temp_path:
+        hashes = get_file_hash(temp_path)
+    if expected and (not hashes or hashes[0] != expected.lower()):
+        upload_session.abort()
+        frappe.throw("The uploaded file does not match the specified hash.", ValueError)
+    return hashes or (None, None)
+
+
+def finalize_upload(
+    team, is_private, parent, home_folder, temp_path, filename, last_modified, embed, hashes
+):
+    """
+    Create the Drive File of an upload once all of its chunks are on disk
+
+    :param hashes: Content hash and fast hash of the upload
+    """
+    title = get_new_title(filename, parent)
 
     # Validate that file size is matching
     file_size = temp_path.stat().st_size
     if file_size != int(frappe.form_dict.total_file_size):
-        temp_path.unlink()
+        UploadSession(frappe.form_dict.uuid).abort()
         frappe.throw("Size on disk does not match specified filesize.", ValueError)
+    content_hash, fast_hash = hashes
 
     mime_type = mimemapper.get_mime_type(str(temp_path), native_first=False)
     if mime_type is None:
         mime_type = magic.from_buffer(open(temp_path, "rb").read(2048), mime=True)
 
+    if blobs.is_enabled():
+        drive_file = create_drive_file(
+            team,
+            is_private,
+            title,
+            parent,
+            file_size,
+            mime_type,
+            last_modified,
+            lambda _: blobs.get_blob_path(content_hash),
+            blob=content_hash,
+            content_hash=content_hash,
+            fast_hash=fast_hash,
+        )
+        blobs.store_upload(drive_file, temp_path, embed)
+        update_file_size(parent, file_size)
+        return drive_file
+
     # Create DB record
     drive_file = create_drive_file(
         team,
@@ -100,6 +249,8 @@ def upload_file(team, personal=None, fullpath=None, parent=None, last_modified=N
         lambda n: Path(home_folder["name"])
         / f"{'embeds' if embed else ''}"
         / f"{n}{temp_path.suffix}",
+        content_hash=content_hash,
+        fast_hash=fast_hash,
     )
 
     # Upload and update parent folder size
@@ -110,6 +261,309 @@ def upload_file(team, personal=None, fullpath=None, parent=None, last_modified=N
     return drive_file
 
 
+def start_multipart_upload(upload_session, manager, home_folder, filename, embed):
+    """
+    Return the S3 multipart upload the chunks of an upload are streamed to, starting it if this
+    is the first chunk to arrive. The Drive File is named upfront, so that the object lands at
+    its usual key.
+    """
+    if multipart := upload_session.get_multipart():
+        return multipart
+    name = frappe.generate_hash(length=10)
+    folder = Path(home_folder["name"]) / ("embeds" if embed else "")
+    s3_key = str(folder / f"{name}{Path(filename).suffix}")
+    upload_id = manager.create_multipart_upload(s3_key)
+    if upload_session.set_multipart(name, s3_key, upload_id):
+        return upload_session.get_multipart()
+    # Started by a concurrent chunk in the meantime
+    manager.abort_multipart_upload(s3_key, upload_id)
+    return upload_session.get_multipart()
+
+
+def finalize_s3_upload(
+    team, is_private, parent, upload_session, filename, last_modified, embed, manager, hashes
+):
+    """
+    Assemble the parts streamed to S3 once every chunk arrived, and create the Drive File
+
+    :param hashes: Content hash and fast hash of the upload
+    """
+    multipart = upload_session.get_multipart()
+    session = upload_session.get()
+    parts = upload_session.get_parts()
+    file_size = sum(p["Size"] for p in parts.values())
+    if file_size != int(frappe.form_dict.total_file_size):
+        upload_session.abort()
+        frappe.throw("Size of the upload does not match specified filesize.", ValueError)
+    manager.complete_multipart_upload(
+        multipart.s3_key, multipart.upload_id, file_size, session.chunk_size, parts
+    )
+
+    drive_file = create_drive_file(
+        team,
+        is_private,
+        get_new_title(filename, parent),
+        parent,
+        file_size,
+        mimetypes.guess_type(filename)[0] or session.get("mime_type"),
+        last_modified,
+        lambda _: multipart.s3_key,
+        name=multipart.name,
+        content_hash=hashes[0],
+        fast_hash=hashes[1],
+    )
+    if not embed and manager.can_create_thumbnail(drive_file):
+        frappe.enqueue(
+            create_thumbnail_from_bucket,
+            entity_name=drive_file.name,
+            enqueue_after_commit=True,
+        )
+    update_file_size(parent, file_size)
+    return drive_file
+
+
+@frappe.whitelist()
+def create_upload_session(
+    team, filename, file_size, chunk_size=None, parent=None, content_hash=None
+):
+    """
+    Open a resumable upload. Its chunks are then sent to `upload_file` with the returned uuid, in
+    any order, and `get_upload_session` tells which of them already arrived.
+
+    :param file_size: Size of the whole file in bytes
+    :param chunk_size: Size of every chunk but the last one. Defaults to UPLOAD_CHUNK_SIZE
+    :param content_hash: Content hash of the file (see HASH_BLOCK_SIZE), checked once every chunk
+        has arrived. Chunks must then be a multiple of HASH_BLOCK_SIZE, as they always must be
+        when they are streamed to S3
+    :raises PermissionError: If the user does not have upload access to the parent folder
+    :raises ValueError: If the team is out of storage
+    :return: Dict with the uuid, chunk size and number of chunks of the upload
+    """
+    home_folder = get_home_folder(team)
+    parent = parent or home_folder["name"]
+    if not user_has_permission(parent, "upload"):
+        frappe.throw("Ask the folder owner for upload access.", frappe.PermissionError)
+
+    file_size = int(file_size)
+    storage_data = storage_bar_data(team)
+    if (storage_data["limit"] - storage_data["total_size"]) < file_size:
+        frappe.throw("You're out of storage!", ValueError)
+
+    chunk_size = int(chunk_size or UPLOAD_CHUNK_SIZE)
+    if content_hash and chunk_size % HASH_BLOCK_SIZE:
+        frappe.throw("Chunks must be a multiple of 4 MiB to check the content hash.", ValueError)
+    if FileManager().s3_enabled and chunk_size % HASH_BLOCK_SIZE:
+        frappe.throw("Chunks must be a multiple of 4 MiB when uploading to S3.", ValueError)
+    total_chunks = max(1, -(-file_size // chunk_size))
+    uuid = frappe.generate_hash()
+    UploadSession(uuid).create(
+        get_upload_path(home_folder["name"], f"{uuid}_{secure_filename(filename)}"),
+        file_size,
+        chunk_size,
+        total_chunks,
+        team=team,
+        parent=parent,
+        filename=filename,
+        content_hash=content_hash,
+    )
+    return {"uuid": uuid, "chunk_size": chunk_size, "total_chunks": total_chunks}
+
+
+@frappe.whitelist()
+def get_upload_session(uuid):
+    """
+    Return what arrived so far of an upload, for the client to resume it
+
+    :raises DoesNotExistError: If the session expired, was aborted or never existed
+    :return: Dict with the received and missing chunk indexes, the received byte ranges, and
+        the Drive File once the upload is complete
+    """
+    upload_session = UploadSession(uuid)
+    if name := upload_session.get_file():
+        return {"uuid": uuid, "complete": True, "file": name}
+
+    session = get_own_upload_session(upload_session)
+    if session.get("upload_id"):
+        # Parts of direct uploads are numbered from 1
+        parts = FileManager().list_parts(session.s3_key, session.upload_id)
+        received = [n - 1 for n in sorted(parts)]
+    else:
+        received = upload_session.get_received()
+    received_set = set(received)
+    return {
+        "uuid": uuid,
+        "complete": False,
+        "file_size": session.file_size,
+        "chunk_size": session.chunk_size,
+        "total_chunks": session.total_chunks,
+        "received_chunks": received,
+        "missing_chunks": [i for i in range(session.total_chunks) if i not in received_set],
+        "received_ranges": get_received_ranges(received, session.chunk_size, session.file_size),
+    }
+
+
+@frappe.whitelist()
+def abort_upload_session(uuid):
+    """
+    Cancel an upload and delete the chunks received so far
+
+    :raises DoesNotExistError: If the session expired, was aborted or never existed
+    :raises ValueError: If the upload is already being saved
+    """
+    upload_session = UploadSession(uuid)
+    get_own_upload_session(upload_session)
+    if upload_session.is_finalizing():
+        frappe.throw("This upload is already being saved.", ValueError)
+    upload_session.abort()
+
+
+@frappe.whitelist()
+def s3_uploads_enabled():
+    """
+    Whether the uploader can send files straight to the S3 bucket, with `create_s3_upload`
+    """
+    return bool(frappe.db.get_single_value("Drive S3 Settings", "enabled"))
+
+
+@frappe.whitelist()
+def create_s3_upload(
+    team, filename, file_size, mime_type=None, parent=None, personal=None, last_modified=None
+):
+    """
+    Start an upload which the browser sends straight to the S3 bucket. Each part is PUT to the
+    presigned URLs returned here and by `get_s3_part_urls`, and `complete_s3_upload` then creates
+    the Drive File. Part `n` holds the bytes from `(n - 1) * part_size`.
+
+    :param file_size: Size of the whole file in bytes
+    :raises ValueError: If S3 storage is not enabled, or the team is out of storage
+    :raises PermissionError: If the user does not have upload access to the parent folder
+    :return: Dict with the uuid of the upload, the part size, the number of parts and the URLs of
+        the first PART_URL_BATCH_SIZE parts
+    """
+    manager = FileManager()
+    if not manager.s3_enabled:
+        frappe.throw("Direct uploads need S3 storage to be enabled.", ValueError)
+    home_folder = get_home_folder(team)
+    parent = parent or home_folder["name"]
+    if not user_has_permission(parent, "upload"):
+        frappe.throw("Ask the folder owner for upload access.", frappe.PermissionError)
+
+    file_size = int(file_size)
+    storage_data = storage_bar_data(team)
+    if (storage_data["limit"] - storage_data["total_size"]) < file_size:
+        frappe.throw("You're out of storage!", ValueError)
+
+    part_size = max(UPLOAD_CHUNK_SIZE, -(-file_size // S3_MAX_PARTS))
+    total_parts = max(1, -(-file_size // part_size))
+    # The Drive File is named upfront, so that the object lands at its usual key
+    name = frappe.generate_hash(length=10)
+    s3_key = str(Path(home_folder["name"]) / f"{name}{Path(filename).suffix}")
+    mime_type = mime_type or mimetypes.guess_type(filename)[0] or "application/octet-stream"
+    upload_id = manager.create_multipart_upload(s3_key, mime_type)
+
+    uuid = frappe.generate_hash()
+    UploadSession(uuid).create(
+        "",
+        file_size,
+        part_size,
+        total_parts,
+        team=team,
+        parent=parent,
+        is_private=int(personal or frappe.get_value("Drive File", parent, "is_private")),
+        filename=filename,
+        mime_type=mime_type,
+        last_modified=last_modified,
+        name=name,
+        s3_key=s3_key,
+        upload_id=upload_id,
+    )
+    return {
+        "uuid": uuid,
+        "part_size": part_size,
+        "total_parts": total_parts,
+        "urls": manager.get_part_urls(
+            s3_key, upload_id, range(1, min(total_parts, PART_URL_BATCH_SIZE) + 1)
+        ),
+    }
+
+
+@frappe.whitelist()
+def get_s3_part_urls(uuid, part_numbers):
+    """
+    Return presigned URLs for more parts of a direct upload
+
+    :param part_numbers: JSON list of part numbers, at most PART_URL_BATCH_SIZE
+    :return: Dict mapping each part number to its URL
+    """
+    session = get_own_upload_session(UploadSession(uuid))
+    if not session.get("upload_id"):
+        frappe.throw("This upload is not sent straight to storage.", ValueError)
+    part_numbers = [int(n) for n in json.loads(part_numbers)][:PART_URL_BATCH_SIZE]
+    if not all(1 <= n <= session.total_chunks for n in part_numbers):
+        frappe.throw("Invalid part number.", ValueError)
+    return FileManager().get_part_urls(session.s3_key, session.upload_id, part_numbers)
+
+
+@frappe.whitelist()
+def complete_s3_upload(uuid):
+    """
+    Assemble the parts of a direct upload once the browser sent all of them, and create its
+    Drive File
+
+    :raises ValueError: If a part is missing or has the wrong size
+    :return: Drive File doc
+    """
+    upload_session = UploadSession(uuid)
+    if name := upload_session.get_file():
+        return frappe.get_doc("Drive File", name)
+    session = get_own_upload_session(upload_session)
+    if not session.get("upload_id"):
+        frappe.throw("This upload is not sent straight to storage.", ValueError)
+    if not user_has_permission(session.parent, "upload"):
+        frappe.throw("Ask the folder owner for upload access.", frappe.PermissionError)
+    if not upload_session.acquire_finalize_lock():
+        frappe.throw("This upload is already being saved.", ValueError)
+
+    manager = FileManager()
+    try:
+        manager.complete_multipart_upload(
+            session.s3_key, session.upload_id, session.file_size, session.chunk_size
+        )
+        drive_file = create_drive_file(
+            session.team,
+            int(session.is_private),
+            get_new_title(session.filename, session.parent),
+            session.parent,
+            session.file_size,
+            session.mime_type,
+            session.get("last_modified"),
+            lambda _: session.s3_key,
+            name=session.name,
+        )
+        update_file_size(session.parent, session.file_size)
+    except Exception:
+        upload_session.release_finalize_lock()
+        raise
+
+    if manager.can_create_thumbnail(drive_file):
+        frappe.enqueue(
+            create_thumbnail_from_bucket,
+            entity_name=drive_file.name,
+            enqueue_after_commit=True,
+        )
+    frappe.db.after_commit.add(lambda: upload_session.set_file(drive_file.name))
+    return drive_file
+
+
+def get_own_upload_session(upload_session):
+    session = upload_session.get()
+    if not session:
+        frappe.throw("This upload session does not exist.", frappe.DoesNotExistError)
+    if session.owner != frappe.session.user:
+        frappe.throw("This upload was started by someone else.", frappe.PermissionError)
+    return session
+
+
 @frappe.whitelist(allow_guest=True)
 def upload_chunked_file(personal=0, parent=None, last_modified=None):
     """
@@ -155,16 +609,21 @@ def upload_chunked_file(personal=0, parent=None, last_modified=None):
     if not mime_type:
         mime_type = magic.from_buffer(open(save_path, "rb").read(2048), mime=True)
 
+    data = file.stream.read()
     with save_path.open("ab") as f:
         f.seek(int(frappe.form_dict.chunk_byte_offset))
-        f.write(file.stream.read())
-
-    if current_chunk + 1 == total_chunks:
-        file_size = save_path.stat().st_size
+        f.write(data)
+    upload_session = UploadSession(name)
+    upload_session.add_digests(current_chunk, frappe.form_dict.chunk_size, data)
+    if current_chunk + 1 < total_chunks:
+        return
 
+    file_size = save_path.stat().st_size
     if file_size != int(frappe.form_dict.total_file_size):
         save_path.unlink()
+        upload_session.abort()
         frappe.throw("Size on disk does not match specified filesize", ValueError)
+    content_hash, fast_hash = get_upload_hashes(upload_session, total_chunks, save_path)
     drive_file = create_drive_file(
         drive_entity.team,
         personal,
@@ -174,8 +633,11 @@ def upload_chunked_file(personal=0, parent=None, last_modified=None):
         mime_type,
         last_modified,
         lambda n: Path(home_directory["name"]) / "embeds" / f"{n}{save_path.suffix}",
+        content_hash=content_hash,
+        fast_hash=fast_hash,
     )
     os.rename(save_path, Path(frappe.get_site_path("private/files")) / drive_file.path)
+    frappe.db.after_commit.add(lambda: upload_session.set_file(drive_file.name))
 
     return drive_file.name + save_path.suffix
 
@@ -269,7 +731,19 @@ def get_upload_path(team_name, file_name):
 
 
 def create_drive_file(
-    team, personal, title, parent, file_size, mime_type, last_modified, entity_path, document=None
+    team,
+    personal,
+    title,
+    parent,
+    file_size,
+    mime_type,
+    last_modified,
+    entity_path,
+    document=None,
+    name=None,
+    blob=None,
+    content_hash=None,
+    fast_hash=None,
 ):
     drive_file = frappe.get_doc(
         {
@@ -281,16 +755,20 @@ def create_drive_file(
             "file_size": file_size,
             "mime_type": mime_type,
             "document": document,
+            "blob": blob,
+            "content_hash": content_hash,
+            "fast_hash": fast_hash,
         }
     )
     drive_file.flags.file_created = True
-    drive_file.insert(ignore_permissions=True)
+    drive_file.insert(ignore_permissions=True, set_name=name)
     drive_file.path = str(entity_path(drive_file.name))
     drive_file.save()
     if last_modified:
         dt_object = datetime.fromtimestamp(int(last_modified) / 1000.0)
         formatted_datetime = dt_object.strftime("%Y-%m-%d %H:%M:%S.%f")
         drive_file.db_set("modified", formatted_datetime, update_modified=False)
+        bump_folder_generation(parent)
     return drive_file
 
 
@@ -361,6 +839,33 @@ def create_folder(team, title, personal=False, parent=None):
     return drive_file
 
 
+@frappe.whitelist()
+def create_upload_folders(team, paths, personal=None, parent=None):
+    """
+    Create, ahead of a folder upload, every folder its files go into, in a single transaction.
+    The files are then uploaded straight into their folder, instead of each upload resolving its
+    `fullpath` one folder at a time.
+
+    :param paths: JSON list of the relative paths of the uploaded files, e.g. ["a/b/c.txt"]
+    :param parent: Document-name of the parent folder. Defaults to the user directory
+    :raises PermissionError: If the user does not have upload access to the parent folder
+    :return: Dict mapping the path of every folder to its document-name, "" being the parent
+    """
+    home_folder = get_home_folder(team)
+    parent = parent or home_folder["name"]
+    is_private = personal or frappe.get_value("Drive File", parent, "is_private")
+
+    if not user_has_permission(parent, "upload"):
+        frappe.throw("Ask the folder owner for upload access.", frappe.PermissionError)
+
+    if isinstance(paths, str):
+        paths = json.loads(paths)
+    folder_paths = {os.path.dirname(path) for path in paths} - {""}
+    # Concurrent uploads into the same folder wait here, rather than creating duplicate folders
+    frappe.db.sql("SELECT name FROM `tabDrive File` WHERE name = %s FOR UPDATE", parent)
+    return create_folder_tree(team, parent, is_private, folder_paths)
+
+
 @frappe.whitelist()
 def create_link(team, title, link, personal=False, parent=None):
     home_folder = get_home_folder(team)
@@ -427,6 +932,7 @@ def save_doc(entity_name, doc_name, content):
 
     frappe.db.set_value("Drive Document", doc_name, "raw_content", content)
     frappe.db.set_value("Drive File", entity_name, "file_size", len(content.encode("utf-8")))
+    bump_entity_parent(entity_name)
 
     mentions = extract_mentions(content)
     if mentions:
@@ -545,6 +1051,7 @@ def get_file_content(entity_name, trigger_download=0, jwt_token=None):
             "is_active",
             "owner",
             "document",
+            "content_hash",
         ],
         as_dict=1,
     )
@@ -555,12 +1062,21 @@ def get_file_content(entity_name, trigger_download=0, jwt_token=None):
         html = frappe.get_value("Drive Document", drive_file.document, "raw_content")
         return html
     else:
+        # The content hash is a strong validator, so revalidations don't touch storage
+        if drive_file.content_hash and frappe.request.if_none_match.contains(
+            drive_file.content_hash
+        ):
+            response = Response(status=304)
+            response.set_etag(drive_file.content_hash)
+            return response
+
         manager = FileManager()
         return send_file(
             manager.get_file(drive_file.path),
             mimetype=drive_file.mime_type,
             as_attachment=trigger_download,
             conditional=True,
+            etag=drive_file.content_hash or True,
             max_age=3600,
             download_name=drive_file.title,
             environ=frappe.request.environ,
@@ -605,6 +1121,35 @@ def stream_file_content(drive_file, range_header):
     return res
 
 
+@frappe.whitelist()
+def get_duplicates(entity_name):
+    """
+    Return the other files of the team with the same content, which the user can read
+
+    :param entity_name: Document-name of the file
+    :return: List of dicts with the name, title and parent of each duplicate
+    """
+    if not user_has_permission(entity_name, "read"):
+        frappe.throw("You do not have permission to view this file", frappe.PermissionError)
+    drive_file = frappe.get_value(
+        "Drive File", entity_name, ["team", "content_hash"], as_dict=True
+    )
+    if not drive_file.content_hash:
+        return []
+    duplicates = frappe.get_all(
+        "Drive File",
+        filters={
+            "team": drive_file.team,
+            "content_hash": drive_file.content_hash,
+            "is_active": 1,
+            "name": ["!=", entity_name],
+        },
+        fields=["name", "title", "parent_entity"],
+    )
+    allowed = set(check_access_many([d.name for d in duplicates], "read")["allowed"])
+    return [d for d in duplicates if d.name in allowed]
+
+
 @frappe.whitelist(allow_guest=True)
 def list_entity_comments(entity_name):
     Comment = frappe.qb.DocType("Comment")
@@ -654,6 +1199,21 @@ def delete_entities(entity_names=None, clear_all=None):
     elif not isinstance(entity_names, list) or not entity_names:
         frappe.throw(f"Expected non-empty list but got {type(entity_names)}", ValueError)
 
+    # Entities can be deleted with write access to them or to their folder
+    denied = check_access_many(entity_names, "write")["denied"]
+    if denied:
+        parents = dict(
+            frappe.get_all(
+                "Drive File",
+                filters={"name": ["in", denied]},
+                fields=["name", "parent_entity"],
+                as_list=True,
+            )
+        )
+        allowed_parents = set(check_access_many(list(parents.values()), "write")["allowed"])
+        if any(parents.get(e) not in allowed_parents for e in denied):
+            frappe.throw("Not permitted", frappe.PermissionError)
+
     for entity in entity_names:
         frappe.get_doc("Drive File", entity).permanent_delete()
 
@@ -667,20 +1227,26 @@ def set_favourite(entities=None, clear_all=False):
     :type entity_names: list[str]
     :raises ValueError: If decoded entity_names is not a list
     """
+    bump_generation("user", frappe.session.user)
     if clear_all:
         return frappe.db.delete("Drive Favourite", {"user": frappe.session.user})
 
     if not isinstance(entities, list):
         frappe.throw(f"Expected list but got {type(entities)}", ValueError)
 
-    for entity in entities:
-        existing_doc = frappe.db.exists(
-            {
-                "doctype": "Drive Favourite",
-                "entity": entity["name"],
-                "user": frappe.session.user,
-            }
+    if check_access_many([e["name"] for e in entities], "read")["denied"]:
+        frappe.throw("Not permitted", frappe.PermissionError)
+    favourites = dict(
+        frappe.get_all(
+            "Drive Favourite",
+            filters={"user": frappe.session.user, "entity": ["in", [e["name"] for e in entities]]},
+            fields=["entity", "name"],
+            as_list=True,
         )
+    )
+
+    for entity in entities:
+        existing_doc = favourites.get(entity["name"])
         if not entity.get("is_favourite"):
             entity["is_favourite"] = not existing_doc
 
@@ -730,23 +1296,23 @@ def remove_or_restore(entity_names, team):
             flag = 1
 
         doc.is_active = flag
-        folder_size = frappe.db.get_value("Drive File", doc.parent_entity, "file_size")
+        folder = frappe.db.get_value(
+            "Drive File", doc.parent_entity, ["file_size", "parent_entity"], as_dict=True
+        )
         frappe.db.set_value(
             "Drive File",
             doc.parent_entity,
             "file_size",
-            folder_size + doc.file_size * (1 if flag else -1),
+            folder.file_size + doc.file_size * (1 if flag else -1),
         )
+        bump_folder_generation(folder.parent_entity)
 
         doc.save()
 
+    if check_access_many(entity_names, "write")["denied"]:
+        raise frappe.PermissionError("You do not have permission to remove this file")
     for entity in entity_names:
-        doc = frappe.get_doc("Drive File", entity)
-        if not frappe.has_permission(
-            doctype="Drive File", user=frappe.session.user, doc=doc, ptype="write"
-        ):
-            raise frappe.PermissionError("You do not have permission to remove this file")
-        depth_zero_toggle_is_active(doc)
+        depth_zero_toggle_is_active(frappe.get_doc("Drive File", entity))
 
 
 @frappe.whitelist(allow_guest=True)
@@ -779,21 +1345,12 @@ def remove_recents(entity_names=[], clear_all=False):
     """
 
     if clear_all:
-        return frappe.db.delete("Drive Entity Log", {"user": frappe.session.user})
+        return remove_user_recents()
 
     if not isinstance(entity_names, list):
         frappe.throw(f"Expected list but got {type(entity_names)}", ValueError)
 
-    for entity in entity_names:
-        existing_doc = frappe.db.exists(
-            {
-                "doctype": "Drive Entity Log",
-                "entity_name": entity,
-                "user": frappe.session.user,
-            }
-        )
-        if existing_doc:
-            frappe.delete_doc("Drive Entity Log", existing_doc)
+    remove_user_recents(entity_names)
 
 
 @frappe.whitelist()
@@ -858,6 +1415,8 @@ def move(entity_names, new_parent=None, is_private=None):
     if not entity_names or not isinstance(entity_names, list):
         frappe.throw(f"Expected a non-empty list but got {type(entity_names)}", ValueError)
 
+    if check_access_many(entity_names, "write")["denied"]:
+        frappe.throw("Not permitted", frappe.PermissionError)
     for entity in entity_names:
         doc = frappe.get_doc("Drive File", entity)
         res = doc.move(new_parent, is_private)
@@ -872,12 +1431,25 @@ def search(query, team):
     """
     Basic search implementation
     """
+    try:
+        result = frappe.db.sql(search_query(query, team, frappe.session.user), as_dict=1)
+        for r in result:
+            r["file_type"] = get_file_type(r)
+        return result
+    except Exception as e:
+        frappe.log_error(frappe.get_traceback(), "Frappe Drive Search Error")
+        return {"error": str(e)}
+
+
+def search_query(query, team, user):
+    """
+    Build the full-text search of `search`, matching the titles of a team against every word of
+    the query as a prefix
+    """
     text = frappe.db.escape(" ".join(k + "*" for k in query.split()))
-    user = frappe.db.escape(frappe.session.user)
+    user = frappe.db.escape(user)
     team = frappe.db.escape(team)
-    try:
-        result = frappe.db.sql(
-            f"""
+    return f"""
         SELECT  `tabDrive File`.name,
                 `tabDrive File`.title,
                 `tabDrive File`.is_group,
@@ -896,15 +1468,7 @@ def search(query, team):
             AND `tabDrive File`.`parent_entity` <> ''
             AND MATCH(title) AGAINST ({text} IN BOOLEAN MODE)
         GROUP  BY `tabDrive File`.`name`
-        """,
-            as_dict=1,
-        )
-        for r in result:
-            r["file_type"] = get_file_type(r)
-        return result
-    except Exception as e:
-        frappe.log_error(frappe.get_traceback(), "Frappe Drive Search Error")
-        return {"error": str(e)}
+        """
 
 
 @frappe.whitelist()
@@ -912,32 +1476,8 @@ def get_ancestors_of(entity_name):
     """
     Return all parent nodes till the root node
     """
-    # CONCAT_WS('/', t.title, gp.path),
-    entity_name = frappe.db.escape(entity_name)
-    result = frappe.db.sql(
-        f"""
-        WITH RECURSIVE generated_path as (
-        SELECT
-            `tabDrive File`.name,
-            `tabDrive File`.parent_entity
-        FROM `tabDrive File`
-        WHERE `tabDrive File`.name = {entity_name}
-
-        UNION ALL
-
-        SELECT
-            t.name,
-            t.parent_entity
-        FROM generated_path as gp
-        JOIN `tabDrive File` as t ON t.name = gp.parent_entity)
-        SELECT name FROM generated_path;
-    """,
-        as_dict=0,
-    )
     # Match the output of frappe/nested.py get_ancestors_of
-    flattened_list = [item for sublist in result for item in sublist]
-    flattened_list.pop(0)
-    return flattened_list
+    return get_ancestors(entity_name)
 
 
 @frappe.whitelist()
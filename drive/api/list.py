@@ -1,8 +1,21 @@
 import frappe
 import json
-from drive.utils.files import get_home_folder, MIME_LIST_MAP, get_file_type
-from .permissions import ENTITY_FIELDS, get_user_access, get_teams
-from pypika import Order, Criterion, functions as fn, CustomFunction
+from datetime import datetime
+from drive.utils.files import get_home_folder, MIME_LIST_MAP, get_file_type, get_share_count
+from drive.utils.pagination import KeysetPaginator, encode_cursor, decode_cursor
+from drive.utils.cache import get_cached_listing, get_cache_stats
+from drive.utils.recents import get_recents
+from .permissions import (
+    ENTITY_FIELDS,
+    get_user_access,
+    get_user_access_many,
+    get_subtree_access,
+    get_teams,
+    is_unexpired,
+)
+from pypika import Criterion, functions as fn
+from pypika.terms import ExistsCriterion
+from werkzeug.wrappers import Response
 
 
 DriveUser = frappe.qb.DocType("User")
@@ -15,7 +28,15 @@ DriveFavourite = frappe.qb.DocType("Drive Favourite")
 Recents = frappe.qb.DocType("Drive Entity Log")
 DriveEntityTag = frappe.qb.DocType("Drive Entity Tag")
 
-Binary = CustomFunction("BINARY", ["expression"])
+STREAM_CHUNK_SIZE = 500
+# Rows per page of listings when the caller doesn't ask for a page size
+PAGE_SIZE = 100
+MAX_TREE_DEPTH = 10
+# Per-row extras of listings, which callers can opt out of
+LISTING_EXTRAS = ["favourite", "accessed", "counts", "file_type", "access"]
+SORT_FIELDS = ["title", "modified", "creation", "file_size", "owner", "mime_type"]
+# What NULL values of sort fields are sorted as (file sizes of folders, mime types of links...)
+NULL_SORT_VALUES = {"file_size": 0, "mime_type": ""}
 
 
 @frappe.whitelist(allow_guest=True)
@@ -24,7 +45,7 @@ def files(
     entity_name=None,
     order_by="modified 1",
     is_active=1,
-    limit=20,
+    limit=PAGE_SIZE,
     cursor=None,
     favourites_only=0,
     recents_only=0,
@@ -33,18 +54,251 @@ def files(
     personal=-1,
     folders=0,
     only_parent=1,
+    fields=None,
+    include=None,
 ):
+    """
+    List the children of a folder, or the favourites, recents or trash of a team, a page at a
+    time
+
+    :param limit: Rows per page
+    :param cursor: Cursor returned with the previous page
+    :return: Dict with the `files` of the page and the `next_cursor` (None on the last page)
+    """
     home = get_home_folder(team)["name"]
-    field, ascending = order_by.split(" ")
+    field, ascending = parse_order_by(order_by)
+    fields, include = parse_projection(fields, include, field)
     is_active = int(is_active)
     only_parent = int(only_parent)
     folders = int(folders)
     personal = int(personal)
-    ascending = int(ascending)
+    limit = int(limit) or PAGE_SIZE
+
+    entity_name, user_access = check_folder_access(team, entity_name or home)
+
+    def get_listing():
+        query = files_query(
+            team,
+            entity_name,
+            home,
+            user_access,
+            is_active=is_active,
+            favourites_only=favourites_only,
+            recents_only=recents_only,
+            tag_list=tag_list,
+            file_kinds=file_kinds,
+            personal=personal,
+            folders=folders,
+            only_parent=only_parent,
+            fields=fields,
+            include=include,
+        )
+        res, next_cursor = get_page(query, field, ascending, recents_only, limit, cursor)
+        return format_listing(res, include), next_cursor
+
+    if only_parent and not recents_only and not favourites_only:
+        res, next_cursor = get_cached_listing(
+            entity_name,
+            team,
+            frappe.session.user,
+            [
+                order_by,
+                is_active,
+                limit,
+                cursor,
+                tag_list,
+                file_kinds,
+                personal,
+                folders,
+                fields,
+                include,
+            ],
+            get_listing,
+        )
+    else:
+        res, next_cursor = get_listing()
+    return {"files": res, "next_cursor": next_cursor}
+
+
+@frappe.whitelist(allow_guest=True)
+def stream_files(
+    team,
+    entity_name=None,
+    order_by="modified 1",
+    is_active=1,
+    favourites_only=0,
+    recents_only=0,
+    tag_list=[],
+    file_kinds=[],
+    personal=-1,
+    folders=0,
+    only_parent=1,
+    fields=None,
+    include=None,
+):
+    """
+    Stream a listing as newline-delimited JSON, with the same filters as `files`.
+
+    Rows are read and sent in chunks of STREAM_CHUNK_SIZE, so that the memory used does not
+    depend on the size of the folder and the client can render the first rows right away.
+    """
+    home = get_home_folder(team)["name"]
+    field, ascending = parse_order_by(order_by)
+    fields, include = parse_projection(fields, include, field)
+    entity_name, user_access = check_folder_access(team, entity_name or home)
+    site, user = frappe.local.site, frappe.session.user
+
+    def get_query():
+        return files_query(
+            team,
+            entity_name,
+            home,
+            user_access,
+            is_active=int(is_active),
+            favourites_only=favourites_only,
+            recents_only=recents_only,
+            tag_list=tag_list,
+            file_kinds=file_kinds,
+            personal=int(personal),
+            folders=int(folders),
+            only_parent=int(only_parent),
+            fields=fields,
+            include=include,
+        )
+
+    def generate():
+        # The response body is iterated after the request was torn down
+        frappe.init(site=site)
+        frappe.connect()
+        frappe.set_user(user)
+        try:
+            cursor = None
+            while True:
+                res, cursor = get_page(
+                    get_query(), field, ascending, recents_only, STREAM_CHUNK_SIZE, cursor
+                )
+                if res:
+                    yield "".join(
+                        frappe.as_json(r, indent=None) + "\n" for r in format_listing(res, include)
+                    )
+                if not cursor:
+                    break
+        finally:
+            frappe.destroy()
+
+    # Validate the filters before the response starts
+    get_query()
+    response = Response(generate(), mimetype="application/x-ndjson")
+    response.headers["X-Accel-Buffering"] = "no"
+    return response
+
+
+@frappe.whitelist(allow_guest=True)
+def folder_tree(team, entity_name=None, depth=3, limit=50, cursor=None):
+    """
+    Return the folders under a folder down to a given depth, in a single recursive query, with
+    the access of the current user resolved for each of them.
+
+    Folders the user cannot read are left out along with their subfolders. When a folder has more
+    than `limit` subfolders, it is given a `cursor` to fetch the rest with another call on it.
+
+    :param depth: Number of levels of subfolders to return (at most MAX_TREE_DEPTH)
+    :param limit: Maximum number of subfolders returned per folder
+    :param cursor: Cursor of the previous page of subfolders of `entity_name`
+    :return: The folder, with its subfolders nested under `children`
+    """
+    home = get_home_folder(team)["name"]
+    entity_name, user_access = check_folder_access(team, entity_name or home)
+    depth = min(max(int(depth), 1), MAX_TREE_DEPTH)
+    limit = int(limit)
+
+    after = ""
+    if cursor:
+        title, name = decode_cursor(cursor)
+        title, name = frappe.db.escape(title), frappe.db.escape(name)
+        after = f"AND (title > {title} OR (title = {title} AND name > {name}))"
+    # The walk only descends into the first `limit` + 1 subfolders of each folder (and any
+    # sharing the title of the last one), the title of the last one being an index lookup
+    nodes = frappe.db.sql(
+        f"""WITH RECURSIVE
+            tree AS (
+                SELECT * FROM (
+                    SELECT name, title, parent_entity, owner, team, is_private, is_group,
+                        1 AS depth
+                    FROM `tabDrive File`
+                    WHERE parent_entity = {frappe.db.escape(entity_name)}
+                        AND is_active = 1 AND is_group = 1 {after}
+                    ORDER BY title, name
+                    LIMIT {limit + 1}
+                ) AS first_level
+                UNION ALL
+                SELECT t.name, t.title, t.parent_entity, t.owner, t.team, t.is_private,
+                    t.is_group, tree.depth + 1
+                FROM tree
+                    JOIN `tabDrive File` AS t ON t.parent_entity = tree.name
+                WHERE t.is_active = 1 AND t.is_group = 1 AND tree.depth < {depth}
+                    AND t.title <= COALESCE(
+                        (
+                            SELECT last.title FROM `tabDrive File` AS last
+                            WHERE last.parent_entity = tree.name
+                                AND last.is_active = 1 AND last.is_group = 1
+                            ORDER BY last.title, last.name
+                            LIMIT 1 OFFSET {limit}
+                        ),
+                        t.title
+                    )
+            )
+        SELECT ranked.*, EXISTS (
+            SELECT 1 FROM `tabDrive File` AS c
+            WHERE c.parent_entity = ranked.name AND c.is_active = 1 AND c.is_group = 1
+        ) AS has_children
+        FROM (
+            SELECT tree.*,
+                ROW_NUMBER() OVER (PARTITION BY parent_entity ORDER BY title, name) AS position
+            FROM tree
+        ) AS ranked
+        WHERE position <= {limit + 1}
+        ORDER BY depth, title, name
+        """,
+        as_dict=True,
+    )
+
+    root = frappe.get_cached_doc("Drive File", entity_name)
+    access = get_subtree_access(root.as_dict(), nodes)
+
+    tree = frappe._dict(name=entity_name, title=root.title, children=[], cursor=None)
+    tree.update(user_access)
+    # Subfolders the user cannot read still exist
+    tree.has_children = bool(cursor) or any(node.depth == 1 for node in nodes)
+    included = {entity_name: tree}
+    last_child = {}
+    # Nodes come ordered by depth, so that parents are always seen before their children
+    for node in nodes:
+        parent = included.get(node.pop("parent_entity"))
+        if not parent:
+            continue
+        if node.pop("position") > limit:
+            # The extra row only tells that the parent has more subfolders
+            parent.cursor = encode_cursor(last_child[parent.name])
+            continue
+        last_child[parent.name] = [node.title, node.name]
+        if not access[node.name]["read"]:
+            continue
+        node.update(access[node.name], children=[], cursor=None)
+        node.has_children = bool(node.has_children)
+        for key in ["team", "is_group", "is_private"]:
+            node.pop(key)
+        included[node.name] = node
+        parent.children.append(node)
+    return tree
 
-    if not entity_name:
-        # If not specified, get home folder
-        entity_name = home
+
+def check_folder_access(team, entity_name):
+    """
+    Verify that the folder exists, is part of the team and can be read by the current user
+
+    :return: The name of the folder and the access of the current user to it
+    """
     entity = frappe.get_doc("Drive File", entity_name)
 
     # Verify that entity exists and is part of the team
@@ -62,49 +316,176 @@ def files(
             f"You don't have access.",
             frappe.exceptions.PageDoesNotExistError,
         )
+    return entity_name, user_access
+
+
+def get_page(query, field, ascending, recents_only, limit, cursor):
+    """
+    Fetch a page of a listing built by `files_query`
+
+    :return: Rows of the page and the cursor of the next page (None if this is the last page)
+    """
+    if recents_only:
+        return get_recents_page(query, limit, cursor)
+    paginator = KeysetPaginator(
+        DriveFile[field],
+        field,
+        DriveFile.name,
+        ascending=ascending,
+        limit=limit,
+        cursor=cursor,
+        null_value=NULL_SORT_VALUES.get(field),
+    )
+    return paginator.paginate(paginator.apply(query).run(as_dict=True))
+
+
+def get_recents_page(query, limit, cursor):
+    """
+    Page through the recents of the current user, in the order of their sorted set.
+
+    The entities of the set are fetched in one query, and the ones which were deleted or can no
+    longer be read are skipped.
+    """
+    limit = int(limit) if limit else None
+    recents = get_recents(after=decode_cursor(cursor) if cursor else None)
+    if not recents:
+        return [], None
+    rows = {
+        r["name"]: r
+        for r in query.where(DriveFile.name.isin([n for n, _ in recents])).run(as_dict=True)
+    }
+
+    res = []
+    for name, accessed in recents:
+        if name not in rows:
+            continue
+        if limit and len(res) == limit:
+            return res, encode_cursor([last_accessed, res[-1]["name"]])
+        rows[name]["accessed"] = datetime.fromtimestamp(accessed)
+        res.append(rows[name])
+        last_accessed = accessed
+    return res, None
+
+
+def parse_projection(fields=None, include=None, sort_field=None):
+    """
+    Validate the columns and extras requested from a listing.
+
+    :param fields: Columns of Drive File to return, all of ENTITY_FIELDS if not given
+    :param include: Extras to compute (see LISTING_EXTRAS), all of them if not given
+    :param sort_field: Field the listing is sorted by, always selected for the cursor
+    :return: List of columns and list of extras
+    """
+    if fields:
+        fields = json.loads(fields) if not isinstance(fields, list) else fields
+        if unknown := set(fields) - set(ENTITY_FIELDS + ["team"]):
+            frappe.throw(f"Cannot select {', '.join(sorted(unknown))}", ValueError)
+    else:
+        fields = ENTITY_FIELDS + ["team"]
+    if include is None:
+        include = LISTING_EXTRAS
+    else:
+        include = json.loads(include) if not isinstance(include, list) else include
+        if unknown := set(include) - set(LISTING_EXTRAS):
+            frappe.throw(f"Cannot include {', '.join(sorted(unknown))}", ValueError)
+
+    # Columns the extras are computed from
+    required = ["name", sort_field]
+    if "file_type" in include:
+        required += ["is_group", "is_link", "mime_type"]
+    if "access" in include:
+        required += ["owner", "team", "is_private", "is_group", "parent_entity"]
+    fields = list(dict.fromkeys(fields + [f for f in required if f]))
+    return fields, list(include)
+
+
+def format_listing(res, include=None):
+    """
+    Add the file type, displayed share count and access of the current user to listed rows
+
+    :param include: Extras to add, all of them if not given
+    """
+    if include is None:
+        include = LISTING_EXTRAS
+    access = get_user_access_many(res) if "access" in include else {}
+    for r in res:
+        if "file_type" in include:
+            r["file_type"] = get_file_type(r)
+        if "counts" in include:
+            r["share_count"] = get_share_count(r)
+        r |= access.get(r["name"], {})
+    return res
+
+
+def files_query(
+    team,
+    entity_name,
+    home,
+    user_access,
+    is_active=1,
+    favourites_only=0,
+    recents_only=0,
+    tag_list=[],
+    file_kinds=[],
+    personal=-1,
+    folders=0,
+    only_parent=1,
+    fields=None,
+    include=None,
+):
+    """
+    Build the (unsorted) query listing the children of a folder, or the favourites, recents or
+    trash of a team.
+
+    The favourites and recents joins and the counts are only added when requested, or needed to
+    filter the listing.
+
+    :param user_access: Access of the current user to the folder
+    :param fields: Columns to select, all of ENTITY_FIELDS and team if not given
+    :param include: Extras to select (see LISTING_EXTRAS), all of them if not given
+    """
+    if fields is None:
+        fields = ENTITY_FIELDS + ["team"]
+    if include is None:
+        include = LISTING_EXTRAS
+    user = frappe.session.user if frappe.session.user != "Guest" else ""
     query = (
         frappe.qb.from_(DriveFile)
         .where(DriveFile.is_active == is_active)
         .left_join(DrivePermission)
-        .on((DrivePermission.entity == DriveFile.name) & (DrivePermission.user == user))
-        # Give defaults as a team member
-        .select(
-            *ENTITY_FIELDS,
+        .on(
+            (DrivePermission.entity == DriveFile.name)
+            & (DrivePermission.user == user)
+            & is_unexpired()
         )
+        # Give defaults as a team member
+        .select(*fields)
         .where(fn.Coalesce(DrivePermission.read, user_access["read"]).as_("read") == 1)
     )
 
-    # Cursor pagination
-    if cursor:
-        query = query.where(
-            (Binary(DriveFile[field]) > cursor if ascending else field < cursor)
-        ).limit(limit)
-
     if only_parent and (not recents_only and not favourites_only):
         query = query.where(DriveFile.parent_entity == entity_name)
     else:
         query = query.where((DriveFile.team == team) & (DriveFile.parent_entity != ""))
 
     # Get favourites data (only that, if applicable)
-    if favourites_only:
-        query = query.right_join(DriveFavourite)
-    else:
-        query = query.left_join(DriveFavourite)
-    query = query.on(
-        (DriveFavourite.entity == DriveFile.name) & (DriveFavourite.user == frappe.session.user)
-    ).select(DriveFavourite.name.as_("is_favourite"))
-
-    if recents_only:
+    if favourites_only or "favourite" in include:
         query = (
-            query.right_join(Recents)
-            .on((Recents.entity_name == DriveFile.name) & (Recents.user == frappe.session.user))
-            .orderby(Recents.last_interaction, order=Order.desc)
+            query.right_join(DriveFavourite)
+            if favourites_only
+            else query.left_join(DriveFavourite)
         )
-    else:
+        query = query.on(
+            (DriveFavourite.entity == DriveFile.name)
+            & (DriveFavourite.user == frappe.session.user)
+        ).select(DriveFavourite.name.as_("is_favourite"))
+
+    # Recents are selected from their sorted set by `get_recents_page`
+    if "accessed" in include and not recents_only:
         query = (
             query.left_join(Recents)
             .on((Recents.entity_name == DriveFile.name) & (Recents.user == frappe.session.user))
-            .orderby(DriveFile[field], order=Order.asc if ascending else Order.desc)
+            .select(Recents.last_interaction.as_("accessed"))
         )
 
     if favourites_only or recents_only:
@@ -125,9 +506,8 @@ def files(
             | ((DriveFile.is_private == 1) & (DriveFile.owner == frappe.session.user))
         )
 
-    query = query.select(Recents.last_interaction.as_("accessed"))
     if tag_list:
-        tag_list = json.loads(tag_list)
+        tag_list = json.loads(tag_list) if not isinstance(tag_list, list) else tag_list
         query = query.left_join(DriveEntityTag).on(DriveEntityTag.parent == DriveFile.name)
         tag_list_criterion = [DriveEntityTag.tag == tags for tags in tag_list]
         query = query.where(Criterion.any(tag_list_criterion))
@@ -145,80 +525,109 @@ def files(
     if folders:
         query = query.where(DriveFile.is_group == 1)
 
-    child_count_query = (
-        frappe.qb.from_(DriveFile)
-        .where((DriveFile.team == team) & (DriveFile.is_active == 1))
-        .select(DriveFile.parent_entity, fn.Count("*").as_("child_count"))
-        .groupby(DriveFile.parent_entity)
-    )
-    share_query = (
-        frappe.qb.from_(DriveFile)
-        .right_join(DrivePermission)
-        .on(DrivePermission.entity == DriveFile.name)
-        .where((DrivePermission.user != "") & (DrivePermission.user != "$TEAM"))
-        .select(DriveFile.name, fn.Count("*").as_("share_count"))
-        .groupby(DriveFile.name)
-    )
-    public_files_query = (
-        frappe.qb.from_(DrivePermission)
-        .where(DrivePermission.user == "")
-        .select(DrivePermission.entity)
-    )
-    team_files_query = (
-        frappe.qb.from_(DrivePermission)
-        .where(DrivePermission.user == "$TEAM")
-        .select(DrivePermission.entity)
-    )
-    public_files = set(k[0] for k in public_files_query.run())
-    team_files = set(k[0] for k in team_files_query.run())
-
-    children_count = dict(child_count_query.run())
-    share_count = dict(share_query.run())
-    res = query.run(as_dict=True)
-    for r in res:
-        r["children"] = children_count.get(r["name"], 0)
-        r["file_type"] = get_file_type(r)
-        if r["name"] in public_files:
-            r["share_count"] = -2
-        elif r["name"] in team_files:
-            r["share_count"] = -1
-        else:
-            r["share_count"] = share_count.get(r["name"], 0)
-        r |= get_user_access(r["name"])
-        print(r)
-
-    return res
+    if "counts" in include:
+        query = query.select(
+            DriveFile.child_count.as_("children"),
+            DriveFile.share_count,
+            DriveFile.general_access,
+        )
+    return query
 
 
 @frappe.whitelist()
 def shared(
     by=0,
-    order_by="modified",
-    limit=1000,
+    order_by="modified 1",
+    limit=PAGE_SIZE,
+    cursor=None,
     tag_list=[],
     mime_type_list=[],
 ):
     """
     Returns the highest level of shared items shared with/by the current user, group or org
 
-    :param entity_name: Document-name of the folder whose contents are to be listed.
-    :raises NotADirectoryError: If this DriveFile doc is not a folder
-    :return: List of DriveEntities with permissions
-    :rtype: list[frappe._dict]
+    An item is at the highest level when its parent is not itself shared with (or by) the current
+    user, which is checked in SQL so that pages are complete and can be paginated with a cursor.
+
+    :param by: List items shared by the current user, instead of items shared with them
+    :param order_by: Sort field followed by 1 (ascending) or 0 (descending)
+    :param limit: Rows per page
+    :param cursor: Cursor returned with the previous page
+    :return: Dict with the `files` of the page, DriveEntities with permissions, and the
+        `next_cursor` (None on the last page)
     """
     by = int(by)
-    query = (
-        frappe.qb.from_(DriveFile)
-        .right_join(DrivePermission)
-        .on(
-            (DrivePermission.entity == DriveFile.name)
-            & ((DrivePermission.owner if by else DrivePermission.user) == frappe.session.user)
+    field, ascending = parse_order_by(order_by)
+    query = shared_query(by, tag_list, mime_type_list)
+
+    # Items shared by the user have a row per recipient, so the permission breaks ties
+    paginator = KeysetPaginator(
+        DriveFile[field],
+        field,
+        DrivePermission.name if by else DriveFile.name,
+        tiebreaker_key="permission" if by else "name",
+        ascending=ascending,
+        limit=int(limit) or PAGE_SIZE,
+        cursor=cursor,
+        null_value=NULL_SORT_VALUES.get(field),
+    )
+    res, next_cursor = paginator.paginate(paginator.apply(query).run(as_dict=True))
+    for r in res:
+        r["file_type"] = get_file_type(r)
+        r["share_count"] = get_share_count(r)
+
+    return {"files": res, "next_cursor": next_cursor}
+
+
+def shared_query(by=0, tag_list=[], mime_type_list=[]):
+    """
+    Build the (unsorted) query listing the highest level of items shared with or by the current
+    user.
+
+    An item is hidden when its parent is listed as well, i.e. when the parent is shared the same
+    way, active and matched by the same filters.
+    """
+    if tag_list and not isinstance(tag_list, list):
+        tag_list = json.loads(tag_list)
+    if mime_type_list and not isinstance(mime_type_list, list):
+        mime_type_list = json.loads(mime_type_list)
+
+    principal = DrivePermission.owner if by else DrivePermission.user
+    ParentPermission = DrivePermission.as_("parent_permission")
+    ParentFile = DriveFile.as_("parent_file")
+    parent_principal = ParentPermission.owner if by else ParentPermission.user
+    return (
+        frappe.qb.from_(DrivePermission)
+        .inner_join(DriveFile)
+        .on(DrivePermission.entity == DriveFile.name)
+        .where(
+            (principal == frappe.session.user)
+            & (DrivePermission.read == 1)
+            & is_unexpired()
+            & shared_filters(DriveFile, tag_list, mime_type_list)
+        )
+        .where(
+            ExistsCriterion(
+                frappe.qb.from_(ParentPermission)
+                .inner_join(ParentFile)
+                .on(ParentFile.name == ParentPermission.entity)
+                .select(ParentPermission.name)
+                .where(
+                    (ParentPermission.entity == DriveFile.parent_entity)
+                    & (parent_principal == frappe.session.user)
+                    & (ParentPermission.read == 1)
+                    & is_unexpired(ParentPermission)
+                    & shared_filters(ParentFile, tag_list, mime_type_list)
+                )
+            ).negate()
         )
-        .limit(limit)
-        .where((DrivePermission.read == 1) & (DriveFile.is_active == 1))
         .select(
             *ENTITY_FIELDS,
             DriveFile.team,
+            DriveFile.child_count.as_("children"),
+            DriveFile.share_count,
+            DriveFile.general_access,
+            DrivePermission.name.as_("permission"),
             DrivePermission.user,
             DrivePermission.owner.as_("sharer"),
             DrivePermission.read,
@@ -228,64 +637,41 @@ def shared(
         )
     )
 
-    query = query.orderby(
-        order_by.split()[0],
-        order=Order.desc if order_by.endswith("desc") else Order.asc,
-    )
 
-    if tag_list:
-        tag_list = json.loads(tag_list)
-        query = query.left_join(DriveEntityTag).on(DriveEntityTag.parent == DriveFile.name)
-        tag_list_criterion = [DriveEntityTag.tag == tags for tags in tag_list]
-        query = query.where(Criterion.any(tag_list_criterion))
+def shared_filters(file, tag_list, mime_type_list):
+    """
+    Conditions an entity of the shared listing has to meet
 
-    if mime_type_list:
-        mime_type_list = json.loads(mime_type_list)
-        query = query.where(
-            Criterion.any(DriveFile.mime_type == mime_type for mime_type in mime_type_list)
+    :param file: Drive File table (or alias) of the entity
+    """
+    criterion = file.is_active == 1
+    if tag_list:
+        criterion &= ExistsCriterion(
+            frappe.qb.from_(DriveEntityTag)
+            .select(DriveEntityTag.name)
+            .where((DriveEntityTag.parent == file.name) & DriveEntityTag.tag.isin(tag_list))
         )
+    if mime_type_list:
+        criterion &= file.mime_type.isin(mime_type_list)
+    return criterion
 
-    # Extremely inefficient
-    child_count_query = (
-        frappe.qb.from_(DriveFile)
-        .where((DriveFile.is_active == 1))
-        .select(DriveFile.parent_entity, fn.Count("*").as_("child_count"))
-        .groupby(DriveFile.parent_entity)
-    )
-    share_query = (
-        frappe.qb.from_(DriveFile)
-        .right_join(DrivePermission)
-        .on(DrivePermission.entity == DriveFile.name)
-        .where((DrivePermission.user != "") & (DrivePermission.user != "$TEAM"))
-        .select(DriveFile.name, fn.Count("*").as_("share_count"))
-        .groupby(DriveFile.name)
-    )
-    public_files_query = (
-        frappe.qb.from_(DrivePermission)
-        .where(DrivePermission.user == "")
-        .select(DrivePermission.entity)
-    )
-    team_files_query = (
-        frappe.qb.from_(DrivePermission)
-        .where(DrivePermission.user == "$TEAM")
-        .select(DrivePermission.entity)
-    )
-    public_files = set(k[0] for k in public_files_query.run())
-    team_files = set(k[0] for k in team_files_query.run())
 
-    children_count = dict(child_count_query.run())
-    share_count = dict(share_query.run())
-    res = query.run(as_dict=True)
-    parents = {r["name"] for r in res}
+def parse_order_by(order_by):
+    """
+    Parse a sort order given as "<field> 1|0" or "<field> asc|desc"
 
-    for r in res:
-        r["children"] = children_count.get(r["name"], 0)
-        r["file_type"] = get_file_type(r)
-        if r["name"] in public_files:
-            r["share_count"] = -2
-        elif r["name"] in team_files:
-            r["share_count"] = -1
-        else:
-            r["share_count"] = share_count.get(r["name"], 0)
-
-    return [r for r in res if r["parent_entity"] not in parents]
+    :return: The field and whether it is sorted in ascending order
+    """
+    field, _, direction = order_by.strip().partition(" ")
+    if field not in SORT_FIELDS:
+        frappe.throw(f"Cannot sort by {field}", ValueError)
+    return field, direction.strip().lower() not in ("0", "desc")
+
+
+@frappe.whitelist()
+def listing_cache_stats():
+    """
+    Hit and miss counters of the folder listing cache
+    """
+    frappe.only_for("System Manager")
+    return get_cache_stats("listing")
@@ -1,5 +1,6 @@
 import frappe
 import json
+from frappe.utils import now_datetime
 from pypika import Order
 
 
@@ -109,6 +110,56 @@ def notify_share(entity_name, docperm_name):
     send_share_email(docshare.user, message, get_link(entity), entity.team, entity_type)
 
 
+def notify_share_many(entity_name, users, from_user):
+    """
+    Create the share notifications of a bulk share, and send its emails in one batch
+    :param entity_name: ID of entity
+    :param users: users the entity was shared with
+    :param from_user: user who shared it
+    """
+    entity = frappe.get_doc("Drive File", entity_name)
+    author_full_name = frappe.db.get_value("User", {"name": from_user}, ["full_name"])
+    entity_type = "document" if entity.document else "folder" if entity.is_group else "file"
+    message = f'{author_full_name} shared a {entity_type} with you: "{entity.title}"'
+
+    now = now_datetime()
+    frappe.db.bulk_insert(
+        "Drive Notification",
+        [
+            "name",
+            "from_user",
+            "to_user",
+            "type",
+            "entity_type",
+            "notif_doctype",
+            "notif_doctype_name",
+            "message",
+            "owner",
+            "modified_by",
+            "creation",
+            "modified",
+        ],
+        [
+            (
+                frappe.generate_hash(),
+                from_user,
+                user,
+                "Share",
+                entity_type.capitalize(),
+                "Drive File",
+                entity.name,
+                message,
+                from_user,
+                from_user,
+                now,
+                now,
+            )
+            for user in users
+        ],
+    )
+    send_share_email(users, message, get_link(entity), entity.team, entity_type)
+
+
 def create_notification(from_user, to_user, type, entity, message=None):
     """
     Create a notification
@@ -3,6 +3,7 @@ from frappe.rate_limiter import rate_limit
 from frappe.utils import escape_html
 from frappe.utils import split_emails, validate_email_address
 from drive.api.permissions import is_admin
+from drive.utils.cache import bump_generation
 from frappe.translate import get_all_translations
 from frappe import _
 
@@ -287,6 +288,8 @@ def set_user_access(team, user_id, access_level):
     drive_team = {k.user: k for k in frappe.get_doc("Drive Team", team).users}
     drive_team[user_id].access_level = access_level
     drive_team[user_id].save()
+    bump_generation("acl", team)
+    bump_generation("member_acl", f"{team}:{user_id}")
 
 
 @frappe.whitelist()
@@ -295,6 +298,8 @@ def remove_user(team, user_id):
     if frappe.session.user not in drive_team:
         frappe.throw("User doesn't belong to team")
     frappe.delete_doc("Drive Team Member", drive_team[user_id].name)
+    bump_generation("acl", team)
+    bump_generation("member_acl", f"{team}:{user_id}")
 
 
 @frappe.whitelist()
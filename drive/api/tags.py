@@ -1,4 +1,5 @@
 import frappe
+from drive.utils.cache import bump_folder_generation
 
 
 @frappe.whitelist()
@@ -108,6 +109,7 @@ def remove_tag(entity, tag=None, all=False):
     for tag_doc in entity_doc.tags:
         if (tag_doc.tag == tag or all) and tag_doc.owner == frappe.session.user:
             tag_doc.delete(ignore_permissions=True)
+    bump_folder_generation(entity_doc.parent_entity)
 
 
 @frappe.whitelist()
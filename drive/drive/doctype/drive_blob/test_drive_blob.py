@@ -0,0 +1,123 @@
+# Copyright (c) 2026, Frappe Technologies Pvt. Ltd. and Contributors
+# See license.txt
+
+import os
+import shutil
+import frappe
+from io import BytesIO
+from PIL import Image
+from frappe.tests import IntegrationTestCase, UnitTestCase
+from drive.drive.doctype.drive_file.test_drive_file import send_chunk
+from drive.utils.blobs import add_reference, collect_garbage, get_blob_path, remove_reference
+from drive.utils.files import FileManager, get_home_folder
+from drive.utils.uploads import HASH_BLOCK_SIZE
+
+# On IntegrationTestCase, the doctype test records and all
+# link-field test record dependencies are recursively loaded
+# Use these module variables to add/remove to/from that list
+EXTRA_TEST_RECORD_DEPENDENCIES = []  # eg. ["User"]
+IGNORE_TEST_RECORD_DEPENDENCIES = []  # eg. ["User"]
+
+
+class UnitTestDriveBlob(UnitTestCase):
+    """
+    Unit tests for DriveBlob.
+    Use this class for testing individual functions and methods.
+    """
+
+    pass
+
+
+class IntegrationTestDriveBlob(IntegrationTestCase):
+    """
+    Integration tests for DriveBlob.
+    Use this class for testing interactions between multiple components.
+    """
+
+    def setUp(self):
+        self.manager = FileManager()
+        self.team = None
+
+    def tearDown(self):
+        frappe.local.request = None
+        if self.team:
+            shutil.rmtree(self.manager.site_folder / get_home_folder(self.team).name)
+        frappe.db.rollback()
+
+    def get_ref_count(self, content_hash):
+        return frappe.db.get_value("Drive Blob", content_hash, "ref_count")
+
+    def test_add_reference(self):
+        content_hash = frappe.generate_hash(length=64)
+        self.assertTrue(add_reference(content_hash, 1024))
+        blob = frappe.get_doc("Drive Blob", content_hash)
+        self.assertEqual(
+            (blob.path, blob.file_size, blob.ref_count), (get_blob_path(content_hash), 1024, 1)
+        )
+
+        self.assertFalse(add_reference(content_hash, 1024))
+        self.assertEqual(self.get_ref_count(content_hash), 2)
+
+    def test_remove_reference(self):
+        content_hash = frappe.generate_hash(length=64)
+        add_reference(content_hash, 1024)
+        add_reference(content_hash, 1024)
+
+        remove_reference(content_hash)
+        self.assertEqual(self.get_ref_count(content_hash), 1)
+        # Unreferenced blobs are left to the garbage collection
+        remove_reference(content_hash)
+        remove_reference(content_hash)
+        self.assertEqual(self.get_ref_count(content_hash), 0)
+
+    def test_collect_garbage(self):
+        unreferenced, referenced = frappe.generate_hash(length=64), frappe.generate_hash(length=64)
+        for content_hash in [unreferenced, referenced]:
+            add_reference(content_hash, 4)
+            path = self.manager.site_folder / get_blob_path(content_hash)
+            path.parent.mkdir(parents=True, exist_ok=True)
+            path.write_bytes(b"blob")
+        remove_reference(unreferenced)
+
+        # Commits, so the blob which is kept is deleted by hand
+        collect_garbage()
+        kept = self.manager.site_folder / get_blob_path(referenced)
+        self.assertTrue(kept.exists())
+        kept.unlink()
+        frappe.db.delete("Drive Blob", referenced)
+        frappe.db.commit()
+
+        self.assertFalse(frappe.db.exists("Drive Blob", unreferenced))
+        self.assertFalse((self.manager.site_folder / get_blob_path(unreferenced)).exists())
+
+    def test_uploads_share_blob(self):
+        enabled = frappe.conf.get("drive_content_addressed_storage")
+        frappe.conf.drive_content_addressed_storage = 1
+        self.addCleanup(frappe.conf.update, {"drive_content_addressed_storage": enabled})
+        self.team = frappe.get_doc({"doctype": "Drive Team", "title": "Blobs"}).insert().name
+        image = BytesIO()
+        Image.frombytes("RGB", (64, 64), os.urandom(64 * 64 * 3)).save(image, format="png")
+        content = image.getvalue()
+
+        first, second = [
+            send_chunk(self.team, frappe.generate_hash(), content, HASH_BLOCK_SIZE, 0, "image.png")
+            for _ in range(2)
+        ]
+        path = self.manager.site_folder / get_blob_path(first.blob)
+        self.addCleanup(path.unlink, missing_ok=True)
+        self.assertEqual(first.blob, second.blob)
+        self.assertEqual(first.path, second.path)
+        self.assertEqual(self.get_ref_count(first.blob), 2)
+        self.assertEqual(path.read_bytes(), content)
+
+        # The content stays for the other file, but not the thumbnail of the deleted one
+        thumbnails = [
+            self.manager.site_folder / self.manager.get_thumbnail_path(self.team, f.name)
+            for f in [first, second]
+        ]
+        self.assertTrue(all(t.exists() for t in thumbnails))
+        first.delete()
+        self.assertEqual(self.get_ref_count(second.blob), 1)
+        self.assertTrue(path.exists())
+        self.assertFalse(thumbnails[0].exists())
+        self.assertTrue(thumbnails[1].exists())
@@ -1,9 +1,13 @@
 # Copyright (c) 2024, Frappe Technologies Pvt. Ltd. and contributors
 # For license information, please see license.txt
 
-# import frappe
+import frappe
 from frappe.model.document import Document
 
 
 class DriveEntityActivityLog(Document):
     pass
+
+
+def on_doctype_update():
+    frappe.db.add_index("Drive Entity Activity Log", ["entity", "creation"])
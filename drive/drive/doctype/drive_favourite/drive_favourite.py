@@ -1,9 +1,13 @@
 # Copyright (c) 2022, Frappe Technologies Pvt. Ltd. and contributors
 # For license information, please see license.txt
 
-# import frappe
+import frappe
 from frappe.model.document import Document
 
 
 class DriveFavourite(Document):
     pass
+
+
+def on_doctype_update():
+    frappe.db.add_index("Drive Favourite", ["user", "entity"])
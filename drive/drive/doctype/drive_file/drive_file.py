@@ -7,11 +7,15 @@ from drive.utils.files import (
     get_new_title,
     get_team_thumbnails_directory,
     update_file_size,
+    update_child_count,
     FileManager,
 )
 from drive.api.files import get_ancestors_of
 from drive.utils.files import generate_upward_path
 from drive.api.activity import create_new_activity_log
+from drive.utils.cache import bump_generation, bump_folder_generation
+from drive.utils.ancestors import add_entity, move_entity, remove_entity
+from drive.utils.blobs import add_reference, remove_reference
 
 
 class DriveFile(Document):
@@ -25,8 +29,35 @@ class DriveFile(Document):
             document_field="title",
             field_new_value=self.title,
         )
+        add_entity(self.name, self.parent_entity)
+        if self.blob:
+            self.flags.new_blob = add_reference(self.blob, self.file_size)
+        if self.is_active == 1:
+            update_child_count(self.parent_entity, 1)
+        bump_folder_generation(self.parent_entity)
+
+    def on_update(self):
+        previous = self.get_doc_before_save()
+        if not previous:
+            return
+        bump_folder_generation(self.parent_entity, previous.parent_entity)
+        if previous.parent_entity != self.parent_entity:
+            move_entity(self.name, self.parent_entity)
+        if previous.parent_entity != self.parent_entity or previous.is_active != self.is_active:
+            if previous.is_active == 1:
+                update_child_count(previous.parent_entity, -1)
+            if self.is_active == 1:
+                update_child_count(self.parent_entity, 1)
+        if previous.parent_entity != self.parent_entity or previous.is_private != self.is_private:
+            # Inherited access changes for the whole subtree
+            bump_generation("acl", self.team)
+            bump_generation("entity_acl", self.name)
 
     def on_trash(self):
+        if self.is_active == 1:
+            update_child_count(self.parent_entity, -1)
+        bump_folder_generation(self.parent_entity)
+        remove_entity(self.name)
         frappe.db.delete("Drive Favourite", {"entity": self.name})
         frappe.db.delete("Drive Entity Log", {"entity_name": self.name})
         frappe.db.delete("Drive Permission", {"entity": self.name})
@@ -48,12 +79,17 @@ class DriveFile(Document):
         if self.document:
             frappe.delete_doc("Drive Document", self.document)
 
-        if self.path:
-            manager = FileManager()
+        manager = FileManager()
+        if self.blob:
+            # The content is shared with the other files of the blob
+            remove_reference(self.blob)
+            manager.delete_thumbnail(self.team, self.name)
+        elif self.path:
             manager.delete_file(self.team, self.name, self.path)
 
     def on_rollback(self):
-        if self.flags.file_created:
+        # Blobs may be shared with other files
+        if self.flags.file_created and not self.blob:
             shutil.rmtree(self.path) if self.is_group else self.path.unlink()
 
     def get_children(self):
@@ -197,6 +233,23 @@ class DriveFile(Document):
             )
             drive_entity.insert()
 
+        elif self.blob:
+            # Content addressed files are only stored once, so copying one is just a new row
+            path = self.path
+            drive_entity = frappe.get_doc(
+                {
+                    "doctype": "Drive File",
+                    "name": name,
+                    "title": title,
+                    "parent_entity": new_parent,
+                    "path": path,
+                    "blob": self.blob,
+                    "file_size": self.file_size,
+                    "mime_type": self.mime_type,
+                }
+            )
+            drive_entity.insert()
+
         else:
             save_path = Path(parent_user_directory.path) / f"{new_parent}_{title}"
             if save_path.exists():
@@ -292,6 +345,7 @@ class DriveFile(Document):
         :raises InvalidColor: If the color is not a hex value string
         :return: DriveEntity doc once it's updated
         """
+        bump_folder_generation(self.parent_entity)
         return frappe.db.set_value(
             "Drive File", self.name, "color", new_color, update_modified=False
         )
@@ -419,3 +473,8 @@ class DriveFile(Document):
 
 def on_doctype_update():
     frappe.db.add_index("Drive File", ["title"])
+    frappe.db.add_index("Drive File", ["parent_entity", "is_active"])
+    frappe.db.add_index("Drive File", ["parent_entity", "is_active", "is_group", "title"])
+    frappe.db.add_index("Drive File", ["team", "is_active", "is_group"])
+    frappe.db.add_index("Drive File", ["owner"])
+    frappe.db.add_index("Drive File", ["team", "content_hash"])
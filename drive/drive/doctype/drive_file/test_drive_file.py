@@ -1,8 +1,22 @@
 # Copyright (c) 2025, Frappe Technologies Pvt. Ltd. and Contributors
 # See license.txt
 
-# import frappe
+import os
+import shutil
+import unittest
+import frappe
+import requests
+from io import BytesIO
+from werkzeug.test import EnvironBuilder
+from werkzeug.wrappers import Request
 from frappe.tests import IntegrationTestCase, UnitTestCase
+from drive.api.files import create_upload_session, get_upload_path, search_query, upload_file
+from drive.api.list import files, files_query, get_page, parse_order_by, shared_query
+from drive.api.permissions import get_permissions_query
+from drive.utils.cache import get_cache_stats
+from drive.utils.files import FileManager, get_home_folder
+from drive.utils.pagination import decode_cursor, encode_cursor
+from drive.utils.uploads import HASH_BLOCK_SIZE, UploadSession, get_file_hash
 
 
 # On IntegrationTestCase, the doctype test records and all
@@ -11,6 +25,45 @@ from frappe.tests import IntegrationTestCase, UnitTestCase
 EXTRA_TEST_RECORD_DEPENDENCIES = []  # eg. ["User"]
 IGNORE_TEST_RECORD_DEPENDENCIES = []  # eg. ["User"]
 
+FULL_ACCESS = {"read": 1, "comment": 1, "share": 1, "upload": 1, "write": 1}
+
+
+def send_chunk(team, uuid, content, chunk_size, chunk_index, filename="upload.bin"):
+    """
+    Call `upload_file` with one chunk of a file, the way the uploader does
+    """
+    start = chunk_index * chunk_size
+    chunk = content[start : start + chunk_size]
+    frappe.local.request = Request(
+        EnvironBuilder(method="POST", data={"file": (BytesIO(chunk), filename)}).get_environ()
+    )
+    frappe.local.form_dict = frappe._dict(
+        uuid=uuid,
+        chunk_index=chunk_index,
+        total_chunk_count=-(-len(content) // chunk_size),
+        total_file_size=len(content),
+        chunk_size=chunk_size,
+        chunk_byte_offset=start,
+    )
+    return upload_file(team)
+
+
+def create_file(team, parent, title, **values):
+    return (
+        frappe.get_doc(
+            {
+                "doctype": "Drive File",
+                "team": team,
+                "parent_entity": parent,
+                "title": title,
+                "mime_type": "text/plain",
+                **values,
+            }
+        )
+        .insert()
+        .name
+    )
+
 
 class UnitTestDriveFile(UnitTestCase):
     """
@@ -18,7 +71,19 @@ class UnitTestDriveFile(UnitTestCase):
     Use this class for testing individual functions and methods.
     """
 
-    pass
+    def test_cursor_round_trip(self):
+        keyset = ["2026-01-01 00:00:00.000000", "a1b2c3d4e5"]
+        self.assertEqual(decode_cursor(encode_cursor(keyset)), keyset)
+
+    def test_malformed_cursor(self):
+        for cursor in [
+            "not a cursor",
+            encode_cursor(["2026-01-01", "a1b2c3d4e5"])[:-4],
+            encode_cursor(["a1b2c3d4e5"]),
+            encode_cursor({"modified": "2026-01-01"}),
+        ]:
+            with self.assertRaises(ValueError):
+                decode_cursor(cursor)
 
 
 class IntegrationTestDriveFile(IntegrationTestCase):
@@ -27,4 +92,208 @@ class IntegrationTestDriveFile(IntegrationTestCase):
     Use this class for testing interactions between multiple components.
     """
 
-    pass
+    def setUp(self):
+        self.team = frappe.get_doc({"doctype": "Drive Team", "title": "Uploads"}).insert().name
+
+    def tearDown(self):
+        frappe.local.request = None
+        shutil.rmtree(FileManager().site_folder / get_home_folder(self.team).name)
+        frappe.db.rollback()
+
+    def assertUsesIndexes(self, query):
+        """
+        Fail if any table in the plan of the query has no index the query could use.
+
+        Indexes the optimizer could use are checked rather than the plan it chose: on the small
+        tables of a test site, a full table scan is often cheaper than any index.
+        """
+        sql = query if isinstance(query, str) else query.get_sql()
+        for row in frappe.db.sql(f"EXPLAIN {sql}", as_dict=True):
+            if not (row.table or "").startswith("tab"):
+                continue
+            # Tables of a single row are read as constants, without an index
+            if row.type != "system":
+                self.assertTrue(
+                    row.possible_keys or row.key, f"No usable index on {row.table} in:\n{sql}"
+                )
+
+    def page_through(self, folder, order_by, limit=2):
+        """
+        :return: Every row of a folder listing, fetched `limit` rows at a time
+        """
+        field, ascending = parse_order_by(order_by)
+        rows, cursor = [], None
+        while True:
+            query = files_query(
+                self.team, folder, folder, FULL_ACCESS, fields=["name", field], include=[]
+            )
+            page, cursor = get_page(query, field, ascending, 0, limit, cursor)
+            self.assertLessEqual(len(page), limit)
+            rows += page
+            if not cursor:
+                return [r.name for r in rows]
+
+    def test_keyset_paging(self):
+        home = get_home_folder(self.team).name
+        sizes = [10, None, 10, 30, None, 10]
+        names = [create_file(self.team, home, f"file-{i}") for i in range(len(sizes))]
+        # Every file modified at the same time, so only their names break the ties
+        for name, size in zip(names, sizes):
+            frappe.db.sql(
+                "UPDATE `tabDrive File` SET modified = %s, file_size = %s WHERE name = %s",
+                ("2026-01-01 00:00:00", size, name),
+            )
+        sizes = dict(zip(names, sizes))
+
+        for order_by in ["modified 1", "modified 0", "file_size 1", "file_size 0"]:
+            field, ascending = parse_order_by(order_by)
+            # Folders and documents have no size, and are sorted as empty
+            key = (lambda n: (sizes[n] or 0, n)) if field == "file_size" else (lambda n: n)
+            self.assertEqual(
+                self.page_through(home, order_by),
+                sorted(names, key=key, reverse=not ascending),
+                order_by,
+            )
+
+    def list_home(self):
+        # Mutations bump the generations of the listings they change once they commit
+        frappe.db.after_commit.run()
+        return sorted(r["title"] for r in files(self.team)["files"])
+
+    def test_listing_cache_invalidation(self):
+        home = get_home_folder(self.team).name
+        create_file(self.team, home, "a.txt")
+        self.assertEqual(self.list_home(), ["a.txt"])
+        hits = get_cache_stats("listing")["hits"]
+        self.assertEqual(self.list_home(), ["a.txt"])
+        self.assertEqual(get_cache_stats("listing")["hits"], hits + 1)
+
+        doc = frappe.get_doc("Drive File", create_file(self.team, home, "b.txt"))
+        self.assertEqual(self.list_home(), ["a.txt", "b.txt"])
+        doc.title = "c.txt"
+        doc.save()
+        self.assertEqual(self.list_home(), ["a.txt", "c.txt"])
+        doc.is_active = 0
+        doc.save()
+        self.assertEqual(self.list_home(), ["a.txt"])
+
+    def test_folder_listing_uses_indexes(self):
+        query = files_query("team", "folder", "home", FULL_ACCESS)
+        self.assertUsesIndexes(query)
+        self.assertUsesIndexes(files_query("team", "folder", "home", FULL_ACCESS, folders=1))
+
+    def test_team_listings_use_indexes(self):
+        for filters in [{"favourites_only": 1}, {"recents_only": 1}, {"is_active": 0}]:
+            self.assertUsesIndexes(
+                files_query("team", "folder", "home", FULL_ACCESS, only_parent=0, **filters)
+            )
+
+    def test_permission_lookup_uses_indexes(self):
+        self.assertUsesIndexes(
+            get_permissions_query(["entity-1", "entity-2"], ["user@example.com", "", "$TEAM"])
+        )
+
+    def test_search_uses_indexes(self):
+        self.assertUsesIndexes(search_query("quarterly report", "team", "user@example.com"))
+
+    def test_shared_listings_use_indexes(self):
+        self.assertUsesIndexes(shared_query(by=0))
+        self.assertUsesIndexes(shared_query(by=1))
+
+    def test_content_hash_of_chunks(self):
+        chunk_size = 2 * HASH_BLOCK_SIZE
+        content = os.urandom(2 * chunk_size + 1024)
+        session = UploadSession(frappe.generate_hash())
+        for i in [2, 0, 1]:
+            session.add_digests(i, chunk_size, content[i * chunk_size : (i + 1) * chunk_size])
+        self.assertIsNone(session.get_content_hash(4))
+
+        path = get_upload_path(get_home_folder(self.team).name, "content.bin")
+        path.write_bytes(content)
+        self.assertEqual(session.get_content_hash(3), get_file_hash(path))
+        session.abort()
+
+    def enable_s3(self):
+        settings = frappe.get_single("Drive S3 Settings")
+        settings.update({"enabled": 1, "signature_version": "s3v4", **frappe.conf.drive_test_s3})
+        settings.save()
+        return FileManager()
+
+    @unittest.skipUnless(
+        frappe.conf.get("drive_test_s3"),
+        "Set drive_test_s3 (endpoint_url, bucket, aws_key, aws_secret) to a local S3 stand-in",
+    )
+    def test_s3_multipart_upload(self):
+        manager = self.enable_s3()
+
+        part_size = 5 * 1024 * 1024
+        content = os.urandom(part_size + 1024)
+        key = f"tests/{frappe.generate_hash()}"
+        upload_id = manager.create_multipart_upload(key)
+        urls = manager.get_part_urls(key, upload_id, [1, 2])
+        requests.put(urls[1], data=content[:part_size]).raise_for_status()
+        with self.assertRaises(ValueError):
+            manager.complete_multipart_upload(key, upload_id, len(content), part_size)
+
+        requests.put(urls[2], data=content[part_size:]).raise_for_status()
+        manager.complete_multipart_upload(key, upload_id, len(content), part_size)
+        body = manager.conn.get_object(Bucket=manager.bucket, Key=key)["Body"].read()
+        manager.conn.delete_object(Bucket=manager.bucket, Key=key)
+        self.assertEqual(body, content)
+
+    def test_chunked_upload(self):
+        content = os.urandom(2 * HASH_BLOCK_SIZE + 1024)
+        uuid = frappe.generate_hash()
+        session = UploadSession(uuid)
+
+        # Chunks may arrive in any order
+        self.assertIsNone(send_chunk(self.team, uuid, content, HASH_BLOCK_SIZE, 2))
+        meta = session.get()
+        self.assertEqual(
+            (meta.owner, meta.file_size, meta.chunk_size, meta.total_chunks),
+            (frappe.session.user, len(content), HASH_BLOCK_SIZE, 3),
+        )
+        self.assertIsNone(send_chunk(self.team, uuid, content, HASH_BLOCK_SIZE, 0))
+        self.assertEqual(session.get_received(), [0, 2])
+
+        drive_file = send_chunk(self.team, uuid, content, HASH_BLOCK_SIZE, 1)
+        self.assertEqual(drive_file.file_size, len(content))
+        frappe.db.after_commit.run()
+        self.assertEqual(session.get_file(), drive_file.name)
+        self.assertIsNone(session.get())
+        path = FileManager().site_folder / drive_file.path
+        self.assertEqual(path.read_bytes(), content)
+        self.assertEqual((drive_file.content_hash, drive_file.fast_hash), get_file_hash(path))
+
+        # A chunk retried after the upload was finalized
+        retried = send_chunk(self.team, uuid, content, HASH_BLOCK_SIZE, 1)
+        self.assertEqual(retried.name, drive_file.name)
+
+    @unittest.skipUnless(
+        frappe.conf.get("drive_test_s3"),
+        "Set drive_test_s3 (endpoint_url, bucket, aws_key, aws_secret) to a local S3 stand-in",
+    )
+    def test_s3_streamed_upload(self):
+        manager = self.enable_s3()
+        # Every part but the last has to be at least 5 MiB, and parts are hashed by block
+        chunk_size = 2 * HASH_BLOCK_SIZE
+        content = os.urandom(2 * chunk_size + 1024)
+        uuid = frappe.generate_hash()
+        with self.assertRaises(ValueError):
+            send_chunk(self.team, uuid, content, 5 * 1024 * 1024, 0)
+        with self.assertRaises(ValueError):
+            create_upload_session(self.team, "upload.bin", len(content), 5 * 1024 * 1024)
+
+        self.assertIsNone(send_chunk(self.team, uuid, content, chunk_size, 2))
+        self.assertIsNone(send_chunk(self.team, uuid, content, chunk_size, 0))
+        self.assertEqual(set(UploadSession(uuid).get_parts()), {1, 3})
+        drive_file = send_chunk(self.team, uuid, content, chunk_size, 1)
+        frappe.db.after_commit.run()
+
+        body = manager.conn.get_object(Bucket=manager.bucket, Key=drive_file.path)["Body"].read()
+        manager.conn.delete_object(Bucket=manager.bucket, Key=drive_file.path)
+        self.assertEqual(drive_file.file_size, len(content))
+        self.assertEqual(body, content)
+        path = get_upload_path(get_home_folder(self.team).name, "content.bin")
+        path.write_bytes(content)
+        self.assertEqual((drive_file.content_hash, drive_file.fast_hash), get_file_hash(path))
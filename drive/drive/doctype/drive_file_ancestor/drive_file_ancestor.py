@@ -0,0 +1,16 @@
+# Copyright (c) 2026, Frappe Technologies Pvt. Ltd. and contributors
+# For license information, please see license.txt
+
+import frappe
+from frappe.model.document import Document
+
+
+class DriveFileAncestor(Document):
+    pass
+
+
+def on_doctype_update():
+    frappe.db.add_unique(
+        "Drive File Ancestor", ["descendant", "ancestor"], constraint_name="descendant_ancestor"
+    )
+    frappe.db.add_index("Drive File Ancestor", ["ancestor", "depth"])
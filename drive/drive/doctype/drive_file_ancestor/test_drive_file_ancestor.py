@@ -0,0 +1,180 @@
+# Copyright (c) 2026, Frappe Technologies Pvt. Ltd. and Contributors
+# See license.txt
+
+import frappe
+from frappe.tests import IntegrationTestCase, UnitTestCase
+from drive.utils.ancestors import CLOSURE_TABLE, check, get_ancestors, get_descendants, rebuild
+from drive.utils.files import create_folder_tree
+
+# On IntegrationTestCase, the doctype test records and all
+# link-field test record dependencies are recursively loaded
+# Use these module variables to add/remove to/from that list
+EXTRA_TEST_RECORD_DEPENDENCIES = []  # eg. ["User"]
+IGNORE_TEST_RECORD_DEPENDENCIES = []  # eg. ["User"]
+
+
+def create_team():
+    """
+    Insert a bare team, without the home folder and directories its hooks create
+    """
+    team = frappe.generate_hash(length=10)
+    frappe.get_doc({"doctype": "Drive Team", "name": team, "title": team}).db_insert()
+    return team
+
+
+def create_folder(team, title, parent=None):
+    return (
+        frappe.get_doc(
+            {
+                "doctype": "Drive File",
+                "title": title,
+                "team": team,
+                "is_group": 1,
+                "parent_entity": parent,
+            }
+        )
+        .insert()
+        .name
+    )
+
+
+class UnitTestDriveFileAncestor(UnitTestCase):
+    """
+    Unit tests for DriveFileAncestor.
+    Use this class for testing individual functions and methods.
+    """
+
+    pass
+
+
+class IntegrationTestDriveFileAncestor(IntegrationTestCase):
+    """
+    Integration tests for DriveFileAncestor.
+    Use this class for testing interactions between multiple components.
+    """
+
+    def setUp(self):
+        # root
+        # ├── a
+        # │   ├── b
+        # │   │   └── c
+        # │   └── d
+        # └── e
+        self.team = create_team()
+        self.root = create_folder(self.team, "root")
+        self.a = create_folder(self.team, "a", self.root)
+        self.b = create_folder(self.team, "b", self.a)
+        self.c = create_folder(self.team, "c", self.b)
+        self.d = create_folder(self.team, "d", self.a)
+        self.e = create_folder(self.team, "e", self.root)
+        self.tree = [self.root, self.a, self.b, self.c, self.d, self.e]
+
+    def tearDown(self):
+        frappe.db.rollback()
+
+    def assertClosureMatchesTree(self):
+        """
+        Compare the closure rows of the tree with the paths given by `parent_entity`
+        """
+        names = [n for n in self.tree if frappe.db.exists("Drive File", n)]
+        expected = set()
+        for name in names:
+            ancestor, depth = name, 0
+            while ancestor:
+                expected.add((ancestor, name, depth))
+                ancestor = frappe.db.get_value("Drive File", ancestor, "parent_entity")
+                depth += 1
+        rows = frappe.db.sql(
+            f"""SELECT ancestor, descendant, depth FROM {CLOSURE_TABLE}
+            WHERE ancestor IN %(names)s OR descendant IN %(names)s
+            """,
+            {"names": tuple(self.tree)},
+        )
+        self.assertEqual({tuple(r) for r in rows}, expected)
+
+    def test_insert_links_every_ancestor(self):
+        self.assertEqual(get_ancestors(self.c), [self.b, self.a, self.root])
+        self.assertEqual(set(get_descendants(self.a)), {self.b, self.c, self.d})
+        self.assertClosureMatchesTree()
+
+    def test_move_subtree(self):
+        doc = frappe.get_doc("Drive File", self.b)
+        doc.parent_entity = self.e
+        doc.save()
+
+        self.assertEqual(get_ancestors(self.c), [self.b, self.e, self.root])
+        self.assertEqual(set(get_descendants(self.a)), {self.d})
+        self.assertEqual(set(get_descendants(self.e)), {self.b, self.c})
+        self.assertClosureMatchesTree()
+
+    def test_delete_subtree(self):
+        frappe.get_doc("Drive File", self.a).delete()
+
+        self.assertEqual(get_descendants(self.root), [self.e])
+        self.assertFalse(
+            frappe.db.sql(
+                f"""SELECT name FROM {CLOSURE_TABLE}
+                WHERE ancestor IN %(names)s OR descendant IN %(names)s
+                """,
+                {"names": (self.a, self.b, self.c, self.d)},
+            )
+        )
+        self.assertClosureMatchesTree()
+
+    def test_rebuild_and_check(self):
+        frappe.db.sql(
+            f"DELETE FROM {CLOSURE_TABLE} WHERE ancestor IN %(names)s", {"names": tuple(self.tree)}
+        )
+        rebuild()
+        self.assertClosureMatchesTree()
+        self.assertTrue(check()["consistent"])
+
+        frappe.db.sql(
+            f"DELETE FROM {CLOSURE_TABLE} WHERE ancestor = %s AND descendant = %s",
+            (self.a, self.c),
+        )
+        frappe.db.sql(
+            f"INSERT INTO {CLOSURE_TABLE} (ancestor, descendant, depth) VALUES (%s, %s, 1)",
+            (self.e, self.d),
+        )
+        result = check()
+        self.assertEqual((result["missing"], result["extra"]), (1, 1))
+        self.assertEqual(
+            [tuple(r.values()) for r in result["missing_sample"]], [(self.a, self.c, 2)]
+        )
+        self.assertEqual(
+            [tuple(r.values()) for r in result["extra_sample"]], [(self.e, self.d, 1)]
+        )
+
+    def test_create_folder_tree(self):
+        paths = ["a/b/x", "a/y/z", "f"]
+        # Lookups alone only resolve trees which exist already
+        self.assertIsNone(create_folder_tree(self.team, self.root, 0, paths, create=False))
+        self.assertEqual(
+            create_folder_tree(self.team, self.root, 0, ["a/b"], create=False),
+            {"": self.root, "a": self.a, "a/b": self.b},
+        )
+        folders = create_folder_tree(self.team, self.root, 0, paths)
+        self.tree += [folders[p] for p in ["a/b/x", "a/y", "a/y/z", "f"]]
+
+        # Existing folders are reused, new ones nested in them
+        self.assertEqual([folders[p] for p in ["", "a", "a/b"]], [self.root, self.a, self.b])
+        self.assertEqual(len(set(folders.values())), len(folders))
+        self.assertEqual(get_ancestors(folders["a/y/z"]), [folders["a/y"], self.a, self.root])
+        self.assertClosureMatchesTree()
+
+        child_counts = {
+            self.root: 3,
+            self.a: 3,
+            self.b: 2,
+            folders["a/y"]: 1,
+            folders["a/y/z"]: 0,
+        }
+        for name, count in child_counts.items():
+            self.assertEqual(frappe.db.get_value("Drive File", name, "child_count"), count)
+
+        # A second upload of the same folders creates nothing
+        self.assertEqual(create_folder_tree(self.team, self.root, 0, paths), folders)
+        self.assertEqual(create_folder_tree(self.team, self.root, 0, paths, create=False), folders)
+        self.assertEqual(frappe.db.get_value("Drive File", self.a, "child_count"), 3)
+        self.assertClosureMatchesTree()
@@ -7,3 +7,7 @@ from frappe.model.document import Document
 
 class DriveNotification(Document):
     pass
+
+
+def on_doctype_update():
+    frappe.db.add_index("Drive Notification", ["to_user", "read", "creation"])
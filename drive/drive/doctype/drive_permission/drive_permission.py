@@ -4,6 +4,7 @@
 import frappe
 from frappe.model.document import Document
 from drive.api.notifications import notify_share
+from drive.utils.files import update_share_count
 
 
 class DrivePermission(Document):
@@ -20,3 +21,16 @@ class DrivePermission(Document):
                 entity_name=self.entity,
                 docperm_name=self.name,
             )
+
+    def on_update(self):
+        update_share_count(self.entity)
+
+    def after_delete(self):
+        update_share_count(self.entity)
+
+
+def on_doctype_update():
+    frappe.db.add_index("Drive Permission", ["entity", "user"])
+    frappe.db.add_index("Drive Permission", ["user"])
+    frappe.db.add_index("Drive Permission", ["owner"])
+    frappe.db.add_index("Drive Permission", ["valid_until"])
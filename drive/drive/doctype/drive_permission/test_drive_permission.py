@@ -1,8 +1,22 @@
 # Copyright (c) 2025, Frappe Technologies Pvt. Ltd. and Contributors
 # See license.txt
 
-# import frappe
+import frappe
+from frappe.utils import add_to_date, now_datetime
 from frappe.tests import IntegrationTestCase, UnitTestCase
+from drive.api.permissions import (
+    ACCESS_CACHE_TTL,
+    check_share_access,
+    get_access_cache_key,
+    get_access_cache_ttl,
+)
+from drive.drive.doctype.drive_file_ancestor.test_drive_file_ancestor import (
+    create_folder,
+    create_team,
+)
+from drive.utils.cache import bump_generation
+from drive.utils.files import update_share_count
+from drive.utils.permission_harness import compare, generate_tree, get_users
 
 
 # On IntegrationTestCase, the doctype test records and all
@@ -27,4 +41,88 @@ class IntegrationTestDrivePermission(IntegrationTestCase):
     Use this class for testing interactions between multiple components.
     """
 
-    pass
+    def test_resolvers_match_reference(self):
+        for seed in range(3):
+            tree = generate_tree(200, grant_rate=0.2, seed=seed)
+            mismatches = compare(tree)
+            frappe.db.rollback()
+            self.assertEqual(mismatches[:5], [], f"seed {seed}")
+
+    def test_access_cache_invalidation(self):
+        team = create_team()
+        root = create_folder(team, "root")
+        shared = create_folder(team, "shared", root)
+        child = create_folder(team, "child", shared)
+        sibling = create_folder(team, "sibling", root)
+        users = ["a@example.com", "b@example.com"]
+
+        def get_keys():
+            frappe.db.after_commit.run()
+            return {
+                (n, u): get_access_cache_key(frappe._dict(name=n, team=team), u)
+                for n in [root, shared, child, sibling]
+                for u in users
+            }
+
+        before = get_keys()
+        # Only the subtree of a shared entity is invalidated, for every user
+        update_share_count(shared)
+        after = get_keys()
+        self.assertEqual(
+            {k for k in before if before[k] != after[k]},
+            {(n, u) for n in [shared, child] for u in users},
+        )
+        # Only the access of a team member whose membership changed
+        bump_generation("member_acl", f"{team}:{users[0]}")
+        before, after = after, get_keys()
+        self.assertEqual(
+            {k for k in before if before[k] != after[k]},
+            {(n, users[0]) for n in [root, shared, child, sibling]},
+        )
+        frappe.db.rollback()
+
+    def test_access_cache_ttl_of_expiring_grants(self):
+        team = create_team()
+        root = create_folder(team, "root")
+        folder = create_folder(team, "folder", root)
+        sibling = create_folder(team, "sibling", root)
+        user, other = get_users(2)
+        self.assertEqual(get_access_cache_ttl(folder, user), ACCESS_CACHE_TTL)
+
+        def grant(entity, user, hours):
+            frappe.get_doc(
+                {
+                    "doctype": "Drive Permission",
+                    "entity": entity,
+                    "user": user,
+                    "read": 1,
+                    "valid_until": add_to_date(now_datetime(), hours=hours),
+                }
+            ).db_insert()
+
+        # Grants of other users, on other entities or which expired already don't count
+        grant(root, other, 1)
+        grant(sibling, user, 1)
+        grant(folder, user, -1)
+        self.assertEqual(get_access_cache_ttl(folder, user), ACCESS_CACHE_TTL)
+        # Grants on ancestors and to the team are inherited
+        grant(root, "$TEAM", 2)
+        self.assertAlmostEqual(get_access_cache_ttl(folder, user), 2 * 60 * 60, delta=5)
+        grant(folder, user, 1)
+        self.assertAlmostEqual(get_access_cache_ttl(folder, user), 60 * 60, delta=5)
+        frappe.db.rollback()
+
+    def test_share_access_of_ancestor_owners(self):
+        team = create_team()
+        root = create_folder(team, "root")
+        folder = create_folder(team, "folder", root)
+        entity = frappe.get_doc("Drive File", create_folder(team, "entity", folder))
+        user = get_users(1)[0]
+        frappe.db.set_value("Drive File", folder, "owner", user, update_modified=False)
+
+        # Owning one of the folders above is not enough
+        with self.assertRaises(frappe.PermissionError):
+            check_share_access(entity, user)
+        frappe.db.set_value("Drive File", root, "owner", user, update_modified=False)
+        check_share_access(entity, user)
+        frappe.db.rollback()
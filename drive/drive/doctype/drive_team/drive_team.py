@@ -6,11 +6,26 @@ from frappe.model.document import Document
 from pathlib import Path
 import shutil
 from drive.utils.files import get_home_folder
+from drive.utils.cache import bump_generation
+from drive.utils.teams import clear_team_cache
 
 
 class DriveTeam(Document):
     def on_update(self):
         """Creates the file on disk"""
+        bump_generation("acl", self.name)
+        previous = self.get_doc_before_save()
+        users = {m.user for m in self.users}
+        if previous:
+            users |= {m.user for m in previous.users}
+        clear_team_cache(self.name, users)
+        # Members added, removed or with a new access level
+        levels = {m.user: m.access_level for m in self.users}
+        previous_levels = {m.user: m.access_level for m in previous.users} if previous else {}
+        bump_generation(
+            "member_acl",
+            *[f"{self.name}:{u}" for u in users if levels.get(u) != previous_levels.get(u)],
+        )
         DriveFile = frappe.qb.DocType("Drive File")
         if (
             frappe.qb.from_(DriveFile)
@@ -3,7 +3,13 @@
 
 # import frappe
 from frappe.model.document import Document
+from drive.utils.teams import clear_team_cache
 
 
 class DriveTeamMember(Document):
-    pass
+    # Only run when a member is saved or deleted on its own, not through its team
+    def on_update(self):
+        clear_team_cache(self.parent, [self.user])
+
+    def on_trash(self):
+        clear_team_cache(self.parent, [self.user])
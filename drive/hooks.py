@@ -134,8 +134,13 @@ has_permission = {
 # ---------------
 
 scheduler_events = {
-    "daily": ["drive.api.files.auto_delete_from_trash", "drive.api.files.clear_deleted_files"],
-    "hourly": ["drive.api.permissions.auto_delete_expired_perms"],
+    "daily": [
+        "drive.api.files.auto_delete_from_trash",
+        "drive.api.files.clear_deleted_files",
+        "drive.utils.blobs.collect_garbage",
+    ],
+    "hourly": ["drive.utils.recents.flush_recents", "drive.utils.uploads.reap_upload_sessions"],
+    "cron": {"* * * * *": ["drive.api.permissions.auto_delete_expired_perms"]},
 }
 
 # Testing
@@ -0,0 +1,19 @@
+import frappe
+
+DOCTYPES = [
+    "Drive File",
+    "Drive Permission",
+    "Drive Entity Log",
+    "Drive Favourite",
+    "Drive Notification",
+    "Drive Entity Activity Log",
+]
+
+
+def execute():
+    """
+    Add the composite indexes used by listings, search and permission checks to existing sites
+    """
+    for doctype in DOCTYPES:
+        module = frappe.scrub(doctype)
+        frappe.get_attr(f"drive.drive.doctype.{module}.{module}.on_doctype_update")()
@@ -0,0 +1,8 @@
+from drive.utils.ancestors import rebuild
+
+
+def execute():
+    """
+    Fill the ancestor closure table of Drive File for existing sites
+    """
+    rebuild()
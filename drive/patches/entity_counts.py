@@ -0,0 +1,42 @@
+import frappe
+
+
+def rebuild():
+    """
+    Recompute the stored child count, share count and general access of every Drive File.
+    Can be re-run at any time with `bench execute drive.patches.entity_counts.rebuild`.
+    """
+    frappe.db.sql("""
+        UPDATE `tabDrive File` f
+        LEFT JOIN (
+            SELECT parent_entity, COUNT(*) AS child_count
+            FROM `tabDrive File`
+            WHERE is_active = 1
+            GROUP BY parent_entity
+        ) c ON c.parent_entity = f.name
+        SET f.child_count = COALESCE(c.child_count, 0)
+    """)
+    frappe.db.sql("""
+        UPDATE `tabDrive File` f
+        LEFT JOIN (
+            SELECT
+                entity,
+                SUM(user != '' AND user != '$TEAM') AS share_count,
+                MAX(user = '') AS is_public,
+                MAX(user = '$TEAM') AS is_team
+            FROM `tabDrive Permission`
+            GROUP BY entity
+        ) p ON p.entity = f.name
+        SET
+            f.share_count = COALESCE(p.share_count, 0),
+            f.general_access = CASE
+                WHEN p.is_public = 1 THEN 'public'
+                WHEN p.is_team = 1 THEN 'team'
+                ELSE 'none'
+            END
+    """)
+    frappe.db.commit()
+
+
+def execute():
+    rebuild()
@@ -0,0 +1,155 @@
+import frappe
+
+# Closure table of the Drive File tree: one row for every (ancestor, descendant) pair, including
+# each entity with itself at depth 0, so that paths and subtrees are a single indexed lookup.
+CLOSURE_TABLE = "`tabDrive File Ancestor`"
+
+
+def add_entity(entity_name, parent_entity):
+    """
+    Link a new entity to itself and to every ancestor of its parent
+    """
+    frappe.db.sql(
+        f"""INSERT INTO {CLOSURE_TABLE} (ancestor, descendant, depth)
+        SELECT ancestor, %(entity)s, depth + 1 FROM {CLOSURE_TABLE} WHERE descendant = %(parent)s
+        UNION ALL
+        SELECT %(entity)s, %(entity)s, 0
+        """,
+        {"entity": entity_name, "parent": parent_entity or ""},
+    )
+
+
+def add_entities(entities):
+    """
+    Batch version of `add_entity`, for a whole subtree of new entities
+
+    :param entities: (name, parent) pairs, each parent listed before its children
+    """
+    new = {name for name, _ in entities}
+    parents = tuple({parent for _, parent in entities if parent and parent not in new})
+    paths = {}
+    if parents:
+        for descendant, ancestor, depth in frappe.db.sql(
+            f"""SELECT descendant, ancestor, depth FROM {CLOSURE_TABLE}
+            WHERE descendant IN %(parents)s
+            """,
+            {"parents": parents},
+        ):
+            paths.setdefault(descendant, []).append((ancestor, depth))
+
+    rows = []
+    for name, parent in entities:
+        paths[name] = [(name, 0)] + [(a, depth + 1) for a, depth in paths.get(parent, [])]
+        rows += [(ancestor, name, depth) for ancestor, depth in paths[name]]
+    frappe.db.bulk_insert("Drive File Ancestor", ["ancestor", "descendant", "depth"], rows)
+
+
+def move_entity(entity_name, new_parent):
+    """
+    Detach the subtree of an entity from its former ancestors and attach it under its new parent
+    """
+    frappe.db.sql(
+        f"""DELETE link FROM {CLOSURE_TABLE} AS link
+        JOIN {CLOSURE_TABLE} AS subtree
+            ON subtree.descendant = link.descendant AND subtree.ancestor = %(entity)s
+        JOIN {CLOSURE_TABLE} AS path
+            ON path.ancestor = link.ancestor AND path.descendant = %(entity)s AND path.depth > 0
+        """,
+        {"entity": entity_name},
+    )
+    frappe.db.sql(
+        f"""INSERT INTO {CLOSURE_TABLE} (ancestor, descendant, depth)
+        SELECT path.ancestor, subtree.descendant, path.depth + subtree.depth + 1
+        FROM {CLOSURE_TABLE} AS path
+        JOIN {CLOSURE_TABLE} AS subtree ON subtree.ancestor = %(entity)s
+        WHERE path.descendant = %(parent)s
+        """,
+        {"entity": entity_name, "parent": new_parent},
+    )
+
+
+def remove_entity(entity_name):
+    frappe.db.sql(
+        f"DELETE FROM {CLOSURE_TABLE} WHERE descendant = %(entity)s OR ancestor = %(entity)s",
+        {"entity": entity_name},
+    )
+
+
+def get_ancestors(entity_name):
+    """
+    Return the names of the ancestors of an entity, from its parent up to the root
+    """
+    return frappe.db.sql_list(
+        f"""SELECT ancestor FROM {CLOSURE_TABLE}
+        WHERE descendant = %(entity)s AND depth > 0
+        ORDER BY depth
+        """,
+        {"entity": entity_name},
+    )
+
+
+def get_descendants(entity_name):
+    """
+    Return the names of all entities under an entity
+    """
+    return frappe.db.sql_list(
+        f"SELECT descendant FROM {CLOSURE_TABLE} WHERE ancestor = %(entity)s AND depth > 0",
+        {"entity": entity_name},
+    )
+
+
+# The closure computed from `parent_entity`, as a recursive walk down from every entity
+CLOSURE_QUERY = """WITH RECURSIVE closure AS (
+        SELECT name AS ancestor, name AS descendant, 0 AS depth
+        FROM `tabDrive File`
+        UNION ALL
+        SELECT closure.ancestor, child.name, closure.depth + 1
+        FROM closure
+        JOIN `tabDrive File` AS child ON child.parent_entity = closure.descendant
+    )
+    SELECT ancestor, descendant, depth FROM closure"""
+
+
+def rebuild():
+    """
+    Recompute the whole closure table from `parent_entity`
+    """
+    frappe.db.sql(f"DELETE FROM {CLOSURE_TABLE}")
+    frappe.db.sql(f"INSERT INTO {CLOSURE_TABLE} (ancestor, descendant, depth) {CLOSURE_QUERY}")
+
+
+def check(limit=20):
+    """
+    Compare the closure table with the tree given by `parent_entity`.
+
+    Run with `bench --site <site> execute drive.utils.ancestors.check`, and fix any difference with
+    `drive.utils.ancestors.rebuild`.
+
+    :return: Dict with the number of missing and extra rows, and samples of both
+    """
+    missing = f"""FROM ({CLOSURE_QUERY}) AS expected
+        LEFT JOIN {CLOSURE_TABLE} AS link
+            ON link.ancestor = expected.ancestor
+            AND link.descendant = expected.descendant
+            AND link.depth = expected.depth
+        WHERE link.name IS NULL"""
+    extra = f"""FROM {CLOSURE_TABLE} AS link
+        LEFT JOIN ({CLOSURE_QUERY}) AS expected
+            ON link.ancestor = expected.ancestor
+            AND link.descendant = expected.descendant
+            AND link.depth = expected.depth
+        WHERE expected.ancestor IS NULL"""
+    fields = "expected.ancestor, expected.descendant, expected.depth"
+    result = {
+        "missing": frappe.db.sql(f"SELECT COUNT(*) {missing}")[0][0],
+        "extra": frappe.db.sql(f"SELECT COUNT(*) {extra}")[0][0],
+        "missing_sample": frappe.db.sql(
+            f"SELECT {fields} {missing} LIMIT {int(limit)}", as_dict=True
+        ),
+        "extra_sample": frappe.db.sql(
+            f"SELECT {fields.replace('expected.', 'link.')} {extra} LIMIT {int(limit)}",
+            as_dict=True,
+        ),
+    }
+    result["consistent"] = not result["missing"] and not result["extra"]
+    return result
@@ -0,0 +1,102 @@
+import os
+import frappe
+from frappe.utils import now_datetime
+
+from drive.utils.files import FileManager
+
+# Content-addressed storage: files are stored once per distinct content, under the content hash
+# of that content (see `drive.utils.uploads`), and every Drive File with the same content points
+# at the same Drive Blob.
+# Turned on with `drive_content_addressed_storage` in the site config.
+BLOBS_FOLDER = "blobs"
+GC_BATCH_SIZE = 500
+
+
+def is_enabled():
+    return bool(frappe.conf.get("drive_content_addressed_storage"))
+
+
+def get_blob_path(content_hash):
+    return f"{BLOBS_FOLDER}/{content_hash[:2]}/{content_hash}"
+
+
+def add_reference(content_hash, file_size):
+    """
+    Count a new Drive File pointing at a blob, creating the blob if needed
+
+    Waits on a blob being garbage collected, in which case the blob is recreated.
+
+    :return: True if the blob is new, and its content still has to be stored
+    """
+    now = now_datetime()
+    frappe.db.sql(
+        """INSERT INTO `tabDrive Blob` (
+            name, content_hash, path, file_size, ref_count,
+            owner, modified_by, creation, modified
+        ) VALUES (
+            %(content_hash)s, %(content_hash)s, %(path)s, %(file_size)s, 1,
+            %(user)s, %(user)s, %(now)s, %(now)s
+        )
+        ON DUPLICATE KEY UPDATE ref_count = ref_count + 1, modified = %(now)s
+        """,
+        {
+            "content_hash": content_hash,
+            "path": get_blob_path(content_hash),
+            "file_size": file_size,
+            "user": frappe.session.user,
+            "now": now,
+        },
+    )
+    # 1 for an insert, 2 for an update
+    return frappe.db.sql("SELECT ROW_COUNT()")[0][0] == 1
+
+
+def remove_reference(content_hash):
+    """
+    Uncount a deleted Drive File. Unreferenced blobs are deleted by `collect_garbage`.
+    """
+    frappe.db.sql(
+        "UPDATE `tabDrive Blob` SET ref_count = ref_count - 1 WHERE name = %s AND ref_count > 0",
+        content_hash,
+    )
+
+
+def store_upload(drive_file, temp_path, embed=False):
+    """
+    Store the content of a new Drive File in its blob, unless another file already did. Either
+    way the temp file is consumed.
+    """
+    manager = FileManager()
+    thumbnail = not embed and manager.can_create_thumbnail(drive_file)
+    if drive_file.flags.new_blob:
+        if not manager.s3_enabled:
+            (manager.site_folder / drive_file.path).parent.mkdir(parents=True, exist_ok=True)
+        manager.upload_file(str(temp_path), drive_file.path, drive_file if thumbnail else None)
+    elif thumbnail and manager.s3_enabled:
+        # Thumbnails are per file, and the upload is the only local copy of the content
+        manager.upload_thumbnail(drive_file, str(temp_path))
+    else:
+        os.remove(temp_path)
+        if thumbnail:
+            manager.upload_thumbnail(drive_file, str(manager.site_folder / drive_file.path))
+
+
+def collect_garbage():
+    """
+    Delete the blobs which no Drive File points at any more, along with their content
+    """
+    manager = FileManager()
+    while names := frappe.get_all(
+        "Drive Blob", filters={"ref_count": 0}, pluck="name", limit=GC_BATCH_SIZE
+    ):
+        for name in names:
+            # Adding a reference to this blob now waits until it is gone, and then recreates it
+            blob = frappe.db.sql(
+                "SELECT path FROM `tabDrive Blob` WHERE name = %s AND ref_count = 0 FOR UPDATE",
+                name,
+                as_dict=True,
+            )
+            if blob:
+                manager.delete_object(blob[0].path)
+                frappe.db.delete("Drive Blob", name)
+            frappe.db.commit()
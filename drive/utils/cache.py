@@ -0,0 +1,140 @@
+import frappe
+import hashlib
+from functools import partial
+
+LISTING_CACHE_TTL = 10 * 60
+LISTING_CACHE_MAX_ENTRIES = 256
+# Generations access depends on: "acl" of a team (its listings), "entity_acl" of an entity (the
+# access to it and its subtree) and "member_acl" of a "team:user" pair (a team membership)
+ACL_SCOPES = ("acl", "entity_acl", "member_acl")
+
+
+def get_generation(scope, name):
+    """
+    Return the current generation of a folder, team or user.
+
+    Cached values embed the generations they were computed under, so changing a generation
+    makes every value that depends on it unreachable. Generations are random rather than
+    counters, so that a generation key evicted from Redis can never be recreated with an
+    old value.
+    """
+    key = frappe.cache().make_key(f"drive:{scope}_generation:{name}")
+    generation = frappe.cache().get(key)
+    if generation is not None:
+        return generation.decode()
+    new_generation = frappe.generate_hash(length=10)
+    if frappe.cache().set(key, new_generation, nx=True):
+        return new_generation
+    # Set concurrently, unless it was evicted again since. Values cached under a generation
+    # nobody else uses are just never read.
+    generation = frappe.cache().get(key)
+    return generation.decode() if generation is not None else new_generation
+
+
+def get_generations(scoped_names):
+    """
+    Batch version of `get_generation`, reading every generation in one round trip
+
+    :param scoped_names: List of (scope, name) pairs
+    :return: List of their generations
+    """
+    keys = [
+        frappe.cache().make_key(f"drive:{scope}_generation:{name}") for scope, name in scoped_names
+    ]
+    values = frappe.cache().mget(keys) if keys else []
+    return [
+        value.decode() if value is not None else get_generation(scope, name)
+        for (scope, name), value in zip(scoped_names, values)
+    ]
+
+
+def bump_generation(scope, *names):
+    """
+    Change the generation of folders, teams or users once the current transaction commits.
+
+    Bumping after the commit ensures that a listing computed from the old rows is never
+    cached under the new generation.
+    """
+    names = {n for n in names if n}
+    if not names:
+        return
+    if scope in ACL_SCOPES:
+        # Access memoized earlier in the request is stale from now on
+        frappe.local.cache.pop("drive_access", None)
+        frappe.flags.drive_acl_changed = True
+    frappe.db.after_commit.add(partial(_set_generations, scope, names))
+
+
+def _set_generations(scope, names):
+    with frappe.cache().pipeline() as pipe:
+        for name in names:
+            pipe.set(
+                frappe.cache().make_key(f"drive:{scope}_generation:{name}"),
+                frappe.generate_hash(length=10),
+            )
+        pipe.execute()
+
+
+def bump_folder_generation(*folders):
+    bump_generation("folder", *folders)
+
+
+def bump_entity_parent(entity):
+    """
+    Invalidate the listing an entity is shown in, after its row was updated in place
+    """
+    bump_folder_generation(frappe.db.get_value("Drive File", entity, "parent_entity"))
+
+
+def record_cache_access(cache, hit):
+    counter = "hits" if hit else "misses"
+    frappe.cache().incr(frappe.cache().make_key(f"drive:{cache}_cache:{counter}"))
+
+
+def get_cache_stats(cache):
+    hits, misses = frappe.cache().mget(
+        [
+            frappe.cache().make_key(f"drive:{cache}_cache:hits"),
+            frappe.cache().make_key(f"drive:{cache}_cache:misses"),
+        ]
+    )
+    hits, misses = int(hits or 0), int(misses or 0)
+    return {
+        "hits": hits,
+        "misses": misses,
+        "hit_rate": hits / (hits + misses) if hits + misses else 0,
+    }
+
+
+def get_cached_listing(folder, team, user, args, generator):
+    """
+    Serve a folder listing from Redis, as long as neither the folder, the permissions of
+    its team nor the user's favourites and recents changed since it was cached.
+
+    :param args: Everything else the listing depends on (filters, sorting, cursor)
+    :param generator: Function computing the listing on a miss
+    """
+    generation = ":".join(
+        [
+            get_generation("folder", folder),
+            get_generation("acl", team),
+            get_generation("user", user),
+        ]
+    )
+    digest = hashlib.sha1(frappe.as_json(args, indent=None).encode()).hexdigest()
+    key = f"drive:listing:{folder}:{generation}:{user}:{digest}"
+
+    listing = frappe.cache().get_value(key)
+    record_cache_access("listing", listing is not None)
+    if listing is not None:
+        return listing
+
+    listing = generator()
+    ttl = frappe.conf.get("drive_listing_cache_ttl") or LISTING_CACHE_TTL
+    # Bound the number of variants (users, sorts, filters) cached per folder generation
+    counter = frappe.cache().make_key(f"drive:listing_count:{folder}:{generation}")
+    with frappe.cache().pipeline() as pipe:
+        count, _ = pipe.incr(counter).expire(counter, ttl).execute()
+    if count <= LISTING_CACHE_MAX_ENTRIES:
+        frappe.cache().set_value(key, listing, expires_in_sec=ttl)
+    return listing
@@ -1,8 +1,11 @@
 import frappe
 import os
+from collections import Counter
 from pathlib import Path
 from PIL import Image, ImageOps
 from drive.locks.distributed_lock import DistributedLock
+from drive.utils.cache import bump_generation, bump_folder_generation, bump_entity_parent
+from drive.utils.ancestors import add_entities, get_ancestors
 import cv2
 from pathlib import Path
 import os
@@ -13,6 +16,7 @@ from botocore.config import Config
 
 
 DriveFile = frappe.qb.DocType("Drive File")
+PRESIGNED_URL_TTL = 6 * 60 * 60
 
 MIME_LIST_MAP = {
     "Image": [
@@ -100,6 +104,17 @@ def get_file_type(r):
             return "Unknown"
 
 
+def get_share_count(r):
+    """
+    Share count as shown in listings: -2 for public, -1 for team, otherwise the number of users
+    """
+    if r["general_access"] == "public":
+        return -2
+    elif r["general_access"] == "team":
+        return -1
+    return r["share_count"]
+
+
 class FileManager:
     ACCEPTABLE_MIME_TYPES = [
         "application/msword",
@@ -247,15 +262,127 @@ class FileManager:
     def get_thumbnail(self, team, name):
         return self.get_file(str(self.get_thumbnail_path(team, name)))
 
-    def delete_file(self, team, name, path):
+    def create_multipart_upload(self, key, mime_type=None):
+        """
+        Start an S3 multipart upload, whose parts are then sent straight to the bucket
+
+        :return: Upload ID
+        """
+        params = {"Bucket": self.bucket, "Key": key}
+        if mime_type:
+            params["ContentType"] = mime_type
+        return self.conn.create_multipart_upload(**params)["UploadId"]
+
+    def get_part_urls(self, key, upload_id, part_numbers, expires_in=PRESIGNED_URL_TTL):
+        """
+        :return: Dict mapping each part number to a presigned URL to PUT it to
+        """
+        return {
+            n: self.conn.generate_presigned_url(
+                "upload_part",
+                Params={
+                    "Bucket": self.bucket,
+                    "Key": key,
+                    "UploadId": upload_id,
+                    "PartNumber": int(n),
+                },
+                ExpiresIn=expires_in,
+            )
+            for n in part_numbers
+        }
+
+    def upload_part(self, key, upload_id, part_number, data):
+        """
+        :return: ETag of the part
+        """
+        return self.conn.upload_part(
+            Bucket=self.bucket, Key=key, UploadId=upload_id, PartNumber=part_number, Body=data
+        )["ETag"]
+
+    def list_parts(self, key, upload_id):
+        """
+        :return: Parts of a multipart upload received by the bucket so far, by part number
+        """
+        parts = {}
+        params = {"Bucket": self.bucket, "Key": key, "UploadId": upload_id}
+        while True:
+            response = self.conn.list_parts(**params)
+            for part in response.get("Parts", []):
+                parts[part["PartNumber"]] = part
+            if not response.get("IsTruncated"):
+                return parts
+            params["PartNumberMarker"] = response["NextPartNumberMarker"]
+
+    def complete_multipart_upload(self, key, upload_id, file_size, part_size, parts=None):
+        """
+        Check that the bucket received every part of a multipart upload with the expected sizes,
+        and assemble them into the object
+
+        :param parts: ETag and size of each part by part number, if known. Listed from the
+            bucket otherwise
+        :raises ValueError: If a part is missing or has the wrong size
+        """
+        if parts is None:
+            parts = self.list_parts(key, upload_id)
+        total_parts = max(1, -(-file_size // part_size))
+        for n in range(1, total_parts + 1):
+            expected = min(part_size, file_size - (n - 1) * part_size)
+            if n not in parts or parts[n]["Size"] != expected:
+                frappe.throw(f"Part {n} of the upload is missing or incomplete.", ValueError)
+        if len(parts) != total_parts:
+            frappe.throw("The upload has more parts than expected.", ValueError)
+
+        self.conn.complete_multipart_upload(
+            Bucket=self.bucket,
+            Key=key,
+            UploadId=upload_id,
+            MultipartUpload={
+                "Parts": [
+                    {"PartNumber": n, "ETag": parts[n]["ETag"]} for n in range(1, total_parts + 1)
+                ]
+            },
+        )
+
+    def abort_multipart_upload(self, key, upload_id):
+        try:
+            self.conn.abort_multipart_upload(Bucket=self.bucket, Key=key, UploadId=upload_id)
+        except self.conn.exceptions.NoSuchUpload:
+            pass
+
+    def delete_object(self, path):
+        """
+        Delete a stored object, such as a blob, which has no thumbnail of its own
+        """
         if self.s3_enabled:
             self.conn.delete_object(Bucket=self.bucket, Key=path)
         else:
-            try:
-                (self.site_folder / path).unlink()
-                self.get_thumbnail_path(team, name).unlink()
-            except FileNotFoundError:
-                pass
+            (self.site_folder / path).unlink(missing_ok=True)
+
+    def delete_file(self, team, name, path):
+        self.delete_object(path)
+        self.delete_thumbnail(team, name)
+
+    def delete_thumbnail(self, team, name):
+        """
+        Delete the thumbnail of a file, which is its own even when its content is a shared blob
+        """
+        self.delete_object(str(self.get_thumbnail_path(team, name)))
+
+
+def create_thumbnail_from_bucket(entity_name):
+    """
+    Download a file uploaded straight to the S3 bucket, and create its thumbnail
+    """
+    manager = FileManager()
+    file = frappe.get_doc("Drive File", entity_name)
+    uploads_path = manager.site_folder / get_home_folder(file.team)["name"] / "uploads"
+    uploads_path.mkdir(exist_ok=True)
+    temp_path = uploads_path / f"{file.name}_thumbnail"
+    try:
+        manager.conn.download_file(manager.bucket, file.path, str(temp_path))
+        manager.upload_thumbnail(file, str(temp_path))
+    finally:
+        temp_path.unlink(missing_ok=True)
 
 
 def get_home_folder(team):
@@ -346,59 +473,36 @@ def dribble_access(path):
 @frappe.whitelist()
 def generate_upward_path(entity_name, user=None):
     """
-    Given an ID traverse upwards till the root node
-    Stops when parent_drive_file IS NULL
+    Given an ID traverse upwards till the root node, using the ancestor closure table
     """
     entity = frappe.db.escape(entity_name)
     if user is None:
         user = frappe.session.user
     user = frappe.db.escape(user if user != "Guest" else "")
     result = frappe.db.sql(
-        f"""WITH RECURSIVE
-            generated_path as (
-                SELECT
-                    `tabDrive File`.title,
-                    `tabDrive File`.name,
-                    `tabDrive File`.team,
-                    `tabDrive File`.parent_entity,
-                    `tabDrive File`.is_private,
-                    `tabDrive File`.owner,
-                    0 AS level
-                FROM
-                    `tabDrive File`
-                WHERE
-                    `tabDrive File`.name = {entity}
-                UNION ALL
-                SELECT
-                    t.title,
-                    t.name,
-                    t.team,
-                    t.parent_entity,
-                    t.is_private,
-                    t.owner,
-                    gp.level + 1
-                FROM
-                    generated_path as gp
-                    JOIN `tabDrive File` as t ON t.name = gp.parent_entity
-            )
-        SELECT
-            gp.title,
-            gp.name,
-            gp.owner,
-            gp.parent_entity,
-            gp.is_private,
-            gp.team,
+        f"""SELECT
+            f.title,
+            f.name,
+            f.owner,
+            f.parent_entity,
+            f.is_private,
+            f.team,
             p.read,
             p.upload,
             p.write,
             p.comment,
             p.share
         FROM
-            generated_path  as gp
+            `tabDrive File Ancestor` as a
+        JOIN `tabDrive File` as f
+        ON f.name = a.ancestor
         LEFT JOIN `tabDrive Permission` as p
-        ON gp.name = p.entity AND p.user = {user}
-        ORDER BY gp.level DESC;
+        ON f.name = p.entity AND p.user = {user}
+            AND (p.valid_until IS NULL OR p.valid_until > %(now)s)
+        WHERE a.descendant = {entity}
+        ORDER BY a.depth DESC;
     """,
+        {"now": frappe.utils.now_datetime()},
         as_dict=1,
     )
     for i, p in enumerate(result):
@@ -422,14 +526,65 @@ def get_valid_breadcrumbs(entity, user_access):
 
 
 def update_file_size(entity, delta):
-    doc = frappe.get_doc("Drive File", entity)
-    while doc.parent_entity:
-        doc.file_size += delta
-        doc.save(ignore_permissions=True)
-        doc = frappe.get_doc("Drive File", doc.parent_entity)
-    # Update root
-    doc.file_size += delta
-    doc.save(ignore_permissions=True)
+    """
+    Atomically adjust the stored size of a folder and of all of its ancestors, leaving the rest
+    of their rows to concurrent updates
+    """
+    if not entity:
+        return
+    folders = [entity] + get_ancestors(entity)
+    (
+        frappe.qb.update(DriveFile)
+        .set(DriveFile.file_size, DriveFile.file_size + delta)
+        .set(DriveFile.modified, frappe.utils.now_datetime())
+        .where(DriveFile.name.isin(folders))
+        .run()
+    )
+    # Each folder is listed in the next one up
+    bump_folder_generation(*folders[1:])
+
+
+def update_child_count(entity, delta):
+    """
+    Atomically adjust the stored number of active children of a folder
+    """
+    if not entity:
+        return
+    (
+        frappe.qb.update(DriveFile)
+        .set(DriveFile.child_count, DriveFile.child_count + delta)
+        .where(DriveFile.name == entity)
+        .run()
+    )
+    bump_entity_parent(entity)
+
+
+def update_share_count(entity):
+    """
+    Recompute the stored share count and general access of an entity from its permissions
+    """
+    users = frappe.get_all("Drive Permission", filters={"entity": entity}, pluck="user")
+    if "" in users:
+        general_access = "public"
+    elif "$TEAM" in users:
+        general_access = "team"
+    else:
+        general_access = "none"
+    frappe.db.set_value(
+        "Drive File",
+        entity,
+        {
+            "share_count": sum(1 for u in users if u and u != "$TEAM"),
+            "general_access": general_access,
+        },
+        update_modified=False,
+    )
+    # Access to the whole subtree may have changed
+    bump_generation("entity_acl", entity)
+    entity = frappe.db.get_value("Drive File", entity, ["parent_entity", "team"], as_dict=True)
+    if entity:
+        bump_folder_generation(entity.parent_entity)
+        bump_generation("acl", entity.team)
 
 
 def if_folder_exists(team, folder_name, parent, personal):
@@ -452,3 +607,147 @@ def if_folder_exists(team, folder_name, parent, personal):
         d = frappe.get_doc({"doctype": "Drive File", **values})
         d.insert()
         return d.name
+
+
+def create_folder_tree(team, parent, personal, folder_paths, create=True):
+    """
+    Find or create every folder of a tree, matching existing folders the way `if_folder_exists`
+    does, with one query per level of the tree and bulk inserts for the new folders
+
+    :param parent: Document-name of the folder the tree is created in
+    :param folder_paths: Relative paths of the folders, e.g. ["a", "a/b"]
+    :param create: Whether to create the missing folders, rather than return None
+    :return: Dict mapping each path, and "" for the parent, to the document-name of its folder
+    """
+    levels = {}
+    for path in folder_paths:
+        parts = [p for p in path.split("/") if p]
+        for depth in range(1, len(parts) + 1):
+            levels.setdefault(depth, set()).add("/".join(parts[:depth]))
+
+    folders = {"": parent}
+    new_folders = []
+    for depth in sorted(levels):
+        paths = sorted(levels[depth])
+        existing = frappe.get_all(
+            "Drive File",
+            filters={
+                "title": ["in", list({p.rpartition("/")[2] for p in paths})],
+                "parent_entity": ["in", list({folders[p.rpartition("/")[0]] for p in paths})],
+                "is_group": 1,
+                "is_active": 1,
+                "team": team,
+                "owner": frappe.session.user,
+                "is_private": personal,
+            },
+            fields=["name", "title", "parent_entity"],
+        )
+        existing = {(f.parent_entity, f.title): f.name for f in existing}
+        for path in paths:
+            parent_path, _, title = path.rpartition("/")
+            key = (folders[parent_path], title)
+            if key not in existing:
+                if not create:
+                    return None
+                existing[key] = frappe.generate_hash(length=10)
+                new_folders.append(
+                    frappe._dict(name=existing[key], title=title, parent_entity=key[0])
+                )
+            folders[path] = existing[key]
+
+    if new_folders:
+        insert_folders(team, personal, new_folders)
+    return folders
+
+
+def insert_folders(team, personal, folders):
+    """
+    Bulk insert new folders, with what `DriveFile.after_insert` does for each of them: closure
+    table rows, activity logs, child counts and listing caches
+
+    :param folders: Dicts with the name, title and parent_entity of each folder, parents first
+    """
+    now = frappe.utils.now_datetime()
+    user = frappe.session.user
+    full_name = frappe.db.get_value("User", user, "full_name")
+    new = {f.name for f in folders}
+    child_counts = Counter(f.parent_entity for f in folders)
+
+    frappe.db.bulk_insert(
+        "Drive File",
+        [
+            "name",
+            "title",
+            "team",
+            "parent_entity",
+            "is_group",
+            "is_active",
+            "is_private",
+            "child_count",
+            "share_count",
+            "general_access",
+            "is_link",
+            "file_size",
+            "owner",
+            "modified_by",
+            "creation",
+            "modified",
+        ],
+        [
+            (
+                f.name,
+                f.title,
+                team,
+                f.parent_entity,
+                1,
+                1,
+                int(personal),
+                child_counts[f.name],
+                0,
+                "none",
+                0,
+                0,
+                user,
+                user,
+                now,
+                now,
+            )
+            for f in folders
+        ],
+    )
+    add_entities([(f.name, f.parent_entity) for f in folders])
+    frappe.db.bulk_insert(
+        "Drive Entity Activity Log",
+        [
+            "name",
+            "entity",
+            "action_type",
+            "message",
+            "document_field",
+            "new_value",
+            "owner",
+            "modified_by",
+            "creation",
+            "modified",
+        ],
+        [
+            (
+                frappe.generate_hash(length=10),
+                f.name,
+                "create",
+                f"{full_name} created {f.title}",
+                "title",
+                f.title,
+                user,
+                user,
+                now,
+                now,
+            )
+            for f in folders
+        ],
+    )
+
+    existing_parents = [p for p in child_counts if p not in new]
+    for parent in existing_parents:
+        update_child_count(parent, child_counts[parent])
+    bump_folder_generation(*existing_parents)
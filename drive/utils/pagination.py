@@ -0,0 +1,99 @@
+import frappe
+import json
+import base64
+from pypika import Order, functions as fn
+
+
+def encode_cursor(values):
+    """
+    Encode the keyset of the last row of a page into an opaque cursor
+    """
+    return base64.urlsafe_b64encode(frappe.as_json(values, indent=None).encode()).decode()
+
+
+def decode_cursor(cursor):
+    """
+    :return: Keyset encoded in the cursor, as a (sort value, tiebreaker) pair
+    :raises ValueError: If the cursor is not one returned by `encode_cursor`
+    """
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except (ValueError, TypeError):
+        values = None
+    if not isinstance(values, list) or len(values) != 2:
+        frappe.throw("Invalid cursor.", ValueError)
+    return values
+
+
+class KeysetPaginator:
+    """
+    Pages through a query ordered by (sort key, unique tiebreaker).
+
+    Each page is fetched with a `WHERE (key, tiebreaker) > (last key, last tiebreaker)` condition
+    instead of an offset, so every page costs the same however deep into the results it is.
+    """
+
+    def __init__(
+        self,
+        column,
+        key,
+        tiebreaker,
+        tiebreaker_key="name",
+        ascending=True,
+        limit=20,
+        cursor=None,
+        null_value=None,
+    ):
+        """
+        :param column: Query column (or expression) to sort by
+        :param key: Field of the result rows holding the sort value
+        :param tiebreaker: Unique query column used to order rows with equal sort values
+        :param tiebreaker_key: Field of the result rows holding the tiebreaker value
+        :param limit: Rows per page, or None for a single page with every row
+        :param null_value: Value to sort NULL values as, so that they can be compared, for columns
+            which can be NULL
+        """
+        self.column = column if null_value is None else fn.Coalesce(column, null_value)
+        self.null_value = null_value
+        self.key = key
+        self.tiebreaker = tiebreaker
+        self.tiebreaker_key = tiebreaker_key
+        self.ascending = ascending
+        self.limit = int(limit) if limit else None
+        self.cursor = decode_cursor(cursor) if cursor else None
+
+    def apply(self, query):
+        """
+        Restrict the query to the page after the cursor.
+        One extra row is fetched to detect whether there is a next page.
+        """
+        if self.cursor:
+            value, tiebreaker = self.cursor
+            if self.ascending:
+                query = query.where(
+                    (self.column > value)
+                    | ((self.column == value) & (self.tiebreaker > tiebreaker))
+                )
+            else:
+                query = query.where(
+                    (self.column < value)
+                    | ((self.column == value) & (self.tiebreaker < tiebreaker))
+                )
+        order = Order.asc if self.ascending else Order.desc
+        query = query.orderby(self.column, order=order).orderby(self.tiebreaker, order=order)
+        return query.limit(self.limit + 1) if self.limit else query
+
+    def paginate(self, rows):
+        """
+        Trim the extra row fetched by `apply`
+
+        :return: Rows of this page and the cursor of the next page (None if this is the last page)
+        """
+        if not self.limit or len(rows) <= self.limit:
+            return rows, None
+        rows = rows[: self.limit]
+        last = rows[-1]
+        value = last[self.key]
+        if value is None:
+            value = self.null_value
+        return rows, encode_cursor([value, last[self.tiebreaker_key]])
@@ -0,0 +1,491 @@
+"""
+Equivalence and benchmark harness for the permission resolvers.
+
+Random team trees are generated with a mix of private, team, public and per-user grants (some
+of them expired or expiring), and every resolver is compared, for every (user, entity) pair,
+against the legacy resolver: `legacy_get_user_access` and `legacy_get_valid_breadcrumbs` are
+verbatim copies of `get_user_access`, `generate_upward_path` (recursive CTE) and
+`get_valid_breadcrumbs` from before the closure table and the caches.
+
+The new resolvers differ on purpose in two ways, which the comparison accounts for:
+
+- Expired grants are ignored as soon as they expire, where the legacy resolver kept granting
+  them until `auto_delete_expired_perms` deleted them. The legacy resolver is thus run after
+  the expired grants of the tree were deleted.
+- Team defaults use the access level of the user whose access is resolved, where the legacy
+  resolver used the level of the session user. The session user is set to the user whose
+  access is resolved, so both agree.
+
+Everything runs inside a transaction which is rolled back, so it can be run on a development
+site with:
+
+    bench --site <site> execute drive.utils.permission_harness.run
+    bench --site <site> execute drive.utils.permission_harness.benchmark \
+        --kwargs "{'sizes': [1000, 100000, 1000000]}"
+"""
+
+import frappe
+import random
+import time
+from contextlib import contextmanager
+from datetime import timedelta
+from frappe.utils import now_datetime
+
+from drive.utils.files import get_valid_breadcrumbs, dribble_access
+from drive.utils.teams import clear_team_cache
+from drive.api.permissions import (
+    ACCESS_TYPES,
+    get_user_access,
+    compute_user_access,
+    get_user_access_many,
+    check_access_many,
+)
+
+BENCHMARK_SIZES = [1000, 100000, 1000000]
+INSERT_CHUNK_SIZE = 10000
+
+
+def generate_tree(size, members=5, outsiders=3, grant_rate=0.05, seed=None):
+    """
+    Insert a random team tree of `size` entities, along with its closure table rows and grants.
+
+    :param members: Number of team members (access levels 0, 1 and 2 are mixed)
+    :param outsiders: Number of users outside of the team, who only get explicit grants
+    :param grant_rate: Share of entities with at least one grant
+    :return: Dict with the `team`, its `members` (user -> access level), the `outsiders`, the
+        `entities` (name -> row, parents listed before children) and the `grants` (entity ->
+        permission rows)
+    """
+    rng = random.Random(seed)
+    now = now_datetime()
+    users = get_users(members + outsiders)
+    tree = frappe._dict(
+        team=frappe.generate_hash(length=10),
+        members={u: rng.choice([0, 1, 1, 2]) for u in users[:members]},
+        outsiders=users[members:],
+        entities={},
+        grants={},
+    )
+
+    team = frappe.get_doc({"doctype": "Drive Team", "name": tree.team, "title": tree.team})
+    team.db_insert()
+    for i, (user, access_level) in enumerate(tree.members.items()):
+        frappe.get_doc(
+            {
+                "doctype": "Drive Team Member",
+                "parent": tree.team,
+                "parenttype": "Drive Team",
+                "parentfield": "users",
+                "idx": i + 1,
+                "user": user,
+                "access_level": access_level,
+            }
+        ).db_insert()
+    clear_team_cache(tree.team, users)
+
+    owners = list(tree.members) + tree.outsiders
+    folders = []
+    ancestors = {}
+    for i in range(size):
+        parent = rng.choice(folders) if folders else None
+        row = frappe._dict(
+            name=frappe.generate_hash(length=10),
+            title=f"Entity {i}",
+            team=tree.team,
+            parent_entity=parent,
+            is_group=int(not folders or rng.random() < 0.2),
+            is_private=int(rng.random() < 0.25),
+            owner=rng.choice(owners),
+        )
+        tree.entities[row.name] = row
+        ancestors[row.name] = [row.name] + (ancestors[parent] if parent else [])
+        if row.is_group:
+            folders.append(row.name)
+
+        if rng.random() < grant_rate:
+            principals = rng.sample(owners + ["", "$TEAM"], k=rng.randint(1, 3))
+            tree.grants[row.name] = [
+                frappe._dict(
+                    name=frappe.generate_hash(length=10),
+                    entity=row.name,
+                    user=p,
+                    valid_until=rng.choice(
+                        [None, None, None, now - timedelta(days=1), now + timedelta(days=1)]
+                    ),
+                    **{t: int(rng.random() < 0.5) for t in ACCESS_TYPES},
+                )
+                for p in principals
+            ]
+
+    fields = ["name", "title", "team", "parent_entity", "is_group", "is_private", "owner"]
+    bulk_insert(
+        "Drive File",
+        fields + ["is_active", "creation", "modified", "modified_by"],
+        [[e[f] for f in fields] + [1, now, now, e.owner] for e in tree.entities.values()],
+    )
+    bulk_insert(
+        "Drive File Ancestor",
+        ["ancestor", "descendant", "depth"],
+        [
+            [ancestor, name, depth]
+            for name, path in ancestors.items()
+            for depth, ancestor in enumerate(path)
+        ],
+    )
+    fields = ["name", "entity", "user", "valid_until"] + ACCESS_TYPES
+    bulk_insert(
+        "Drive Permission",
+        fields + ["owner", "creation", "modified"],
+        [
+            [g[f] for f in fields] + ["Administrator", now, now]
+            for grants in tree.grants.values()
+            for g in grants
+        ],
+    )
+    return tree
+
+
+def get_users(count):
+    """
+    Return `count` harness users, creating the missing ones
+    """
+    users = [f"drive-harness-{i}@example.com" for i in range(count)]
+    for user in users:
+        if not frappe.db.exists("User", user):
+            frappe.get_doc(
+                {"doctype": "User", "email": user, "first_name": user, "send_welcome_email": 0}
+            ).insert(ignore_permissions=True)
+    return users
+
+
+def bulk_insert(doctype, fields, values):
+    for i in range(0, len(values), INSERT_CHUNK_SIZE):
+        frappe.db.bulk_insert(doctype, fields, values[i : i + INSERT_CHUNK_SIZE])
+
+
+def legacy_get_user_access(entity, user):
+    """
+    `get_user_access` as it was before the closure table and the caches
+    """
+    if user == entity.owner:
+        return {"read": 1, "comment": 1, "share": 1, "upload": 1, "write": 1, "type": "admin"}
+
+    # Default access based on public or team view
+    teams = legacy_get_teams(user)
+    if entity.team in teams and entity.is_private == 0:
+        # Everyone can upload to team folders, and admins can edit all files
+        access_level = legacy_get_access_level(entity.team)
+        access = {
+            "read": 1,
+            "comment": 1,
+            "share": 1,
+            "upload": int(entity.is_group),
+            "write": int(access_level == 2 or entity.owner == user),
+            "type": {2: "team-admin", 1: "team", 0: "guest"}[access_level],
+        }
+    else:
+        access = {
+            "read": 0,
+            "comment": 0,
+            "share": 0,
+            "write": 0,
+            "upload": 0,
+        }
+
+    path = legacy_generate_upward_path(entity.name, user)
+    user_access = {k: v for k, v in path[-1].items() if k in access.keys()}
+    if not user or user == "Guest":
+        return user_access
+
+    public_path = legacy_generate_upward_path(entity.name, "Guest")
+    public_access = {k: v for k, v in public_path[-1].items() if k in access.keys()}
+
+    valid_accesses = [user_access, public_access]
+    if entity.team in teams:
+        team_path = legacy_generate_upward_path(entity.name, "$TEAM")
+        team_access = {k: v for k, v in team_path[-1].items() if k in access.keys()}
+        valid_accesses.append(team_access)
+    for access_type in valid_accesses:
+        for type, v in access_type.items():
+            if v:
+                access[type] = 1
+
+    return access
+
+
+def legacy_get_access_level(team):
+    drive_team = {k.user: k for k in frappe.get_doc("Drive Team", team).users}
+    return drive_team[frappe.session.user].access_level
+
+
+def legacy_get_teams(user):
+    return frappe.get_all(
+        "Drive Team Member",
+        pluck="parent",
+        filters=[
+            ["parenttype", "=", "Drive Team"],
+            ["user", "=", user],
+        ],
+    )
+
+
+def legacy_generate_upward_path(entity_name, user=None):
+    """
+    `generate_upward_path` as it was before the closure table, walking up `parent_entity`
+    """
+    entity = frappe.db.escape(entity_name)
+    if user is None:
+        user = frappe.session.user
+    user = frappe.db.escape(user if user != "Guest" else "")
+    result = frappe.db.sql(
+        f"""WITH RECURSIVE
+            generated_path as (
+                SELECT
+                    `tabDrive File`.title,
+                    `tabDrive File`.name,
+                    `tabDrive File`.team,
+                    `tabDrive File`.parent_entity,
+                    `tabDrive File`.is_private,
+                    `tabDrive File`.owner,
+                    0 AS level
+                FROM
+                    `tabDrive File`
+                WHERE
+                    `tabDrive File`.name = {entity}
+                UNION ALL
+                SELECT
+                    t.title,
+                    t.name,
+                    t.team,
+                    t.parent_entity,
+                    t.is_private,
+                    t.owner,
+                    gp.level + 1
+                FROM
+                    generated_path as gp
+                    JOIN `tabDrive File` as t ON t.name = gp.parent_entity
+            )
+        SELECT
+            gp.title,
+            gp.name,
+            gp.owner,
+            gp.parent_entity,
+            gp.is_private,
+            gp.team,
+            p.read,
+            p.upload,
+            p.write,
+            p.comment,
+            p.share
+        FROM
+            generated_path  as gp
+        LEFT JOIN `tabDrive Permission` as p
+        ON gp.name = p.entity AND p.user = {user}
+        ORDER BY gp.level DESC;
+    """,
+        as_dict=1,
+    )
+    for i, p in enumerate(result):
+        result[i] = {**p, **dribble_access(result[: i + 1])}
+    return result
+
+
+def legacy_get_valid_breadcrumbs(entity, user_access):
+    """
+    `get_valid_breadcrumbs` as it was before the closure table
+    """
+    file_path = legacy_generate_upward_path(entity.name)
+
+    # If team/admin of this entity, then entire path
+    if user_access.get("type") in ["admin", "team"]:
+        return file_path
+
+    # Otherwise, slice where they lose read access.
+    lose_access = next((i for i, k in enumerate(file_path[::-1]) if not k["read"]), 0)
+    return file_path[-lose_access:]
+
+
+def legacy_get_user_access_as(entity, user):
+    # The legacy resolver reads the access level of the session user
+    frappe.session.user = user
+    return legacy_get_user_access(entity, user)
+
+
+def delete_expired_grants(tree):
+    """
+    Delete the expired grants of a tree, as `auto_delete_expired_perms` would
+    """
+    now = now_datetime()
+    expired = [
+        g.name
+        for grants in tree.grants.values()
+        for g in grants
+        if g.valid_until and g.valid_until <= now
+    ]
+    if expired:
+        frappe.db.delete("Drive Permission", {"name": ["in", expired]})
+
+
+def normalize(access):
+    return {k: access.get(k) for k in ACCESS_TYPES + ["type"] if k in access}
+
+
+def compare(tree, users=None, entities=None):
+    """
+    Compare every resolver against the legacy resolver for every (user, entity) pair.
+
+    The new resolvers are run first, then the expired grants are deleted and the legacy
+    resolver is run (see the module docstring).
+
+    :return: List of mismatches, each with the resolver, user, entity and both results
+    """
+    users = users or list(tree.members) + tree.outsiders + ["Guest"]
+    names = entities or list(tree.entities)
+    rows = [tree.entities[n] for n in names]
+
+    results = {}
+    for user in users:
+        frappe.set_user(user)
+        many = get_user_access_many(rows, user)
+        allowed = {t: set(check_access_many(names, t, user)["allowed"]) for t in ["read", "write"]}
+        for name in names:
+            entity = tree.entities[name]
+            access = get_user_access(entity, user)
+            result = results[user, name] = {
+                "compute_user_access": normalize(compute_user_access(entity, user)),
+                "get_user_access": normalize(access),
+                "get_user_access_many": normalize(many[name]),
+                **{f"check_access_many:{t}": name in allowed[t] for t in allowed},
+            }
+            if user != "Guest":
+                result["get_valid_breadcrumbs"] = [
+                    b["name"] for b in get_valid_breadcrumbs(entity, access)
+                ]
+
+    delete_expired_grants(tree)
+    mismatches = []
+    for user in users:
+        frappe.set_user(user)
+        for name in names:
+            entity = tree.entities[name]
+            legacy = legacy_get_user_access(entity, user)
+            expected = {
+                "compute_user_access": normalize(legacy),
+                "get_user_access": normalize(legacy),
+                "get_user_access_many": normalize(legacy),
+                "check_access_many:read": bool(legacy["read"]),
+                "check_access_many:write": bool(legacy["write"]),
+            }
+            if user != "Guest":
+                expected["get_valid_breadcrumbs"] = [
+                    b["name"] for b in legacy_get_valid_breadcrumbs(entity, legacy)
+                ]
+            for resolver, value in expected.items():
+                result = results[user, name][resolver]
+                if result != value:
+                    mismatches.append(
+                        frappe._dict(
+                            resolver=resolver,
+                            user=user,
+                            entity=name,
+                            result=result,
+                            expected=value,
+                        )
+                    )
+    frappe.set_user("Administrator")
+    return mismatches
+
+
+@contextmanager
+def count_queries():
+    """
+    Count the queries run in the block: `with count_queries() as counter: ...; counter["queries"]`
+    """
+    counter = {"queries": 0}
+    sql = frappe.db.sql
+
+    def counting_sql(*args, **kwargs):
+        counter["queries"] += 1
+        return sql(*args, **kwargs)
+
+    frappe.db.sql = counting_sql
+    try:
+        yield counter
+    finally:
+        frappe.db.sql = sql
+
+
+def measure(function, calls):
+    """
+    Time a function over a list of argument tuples
+
+    :return: Mean and 95th percentile latency in milliseconds, and queries per call
+    """
+    timings = []
+    with count_queries() as counter:
+        for args in calls:
+            start = time.perf_counter()
+            function(*args)
+            timings.append((time.perf_counter() - start) * 1000)
+    timings.sort()
+    return {
+        "mean_ms": round(sum(timings) / len(timings), 3),
+        "p95_ms": round(timings[int(len(timings) * 0.95)], 3),
+        "queries_per_call": round(counter["queries"] / len(calls), 2),
+    }
+
+
+def run(size=200, seed=0):
+    """
+    Generate a tree and compare all resolvers on it, then roll it back
+
+    :return: Number of pairs compared and the first mismatches
+    """
+    try:
+        tree = generate_tree(int(size), seed=seed)
+        mismatches = compare(tree)
+        users = len(tree.members) + len(tree.outsiders) + 1
+        return {
+            "pairs": users * len(tree.entities),
+            "mismatches": len(mismatches),
+            "sample": mismatches[:20],
+        }
+    finally:
+        frappe.db.rollback()
+
+
+def benchmark(sizes=BENCHMARK_SIZES, samples=200, page_size=50, seed=0):
+    """
+    Measure the latency and query count of the resolvers on trees of increasing sizes
+
+    :param samples: Number of random (user, entity) pairs, and pages, timed per size
+    :return: Dict mapping each size to the measures of each resolver
+    """
+    rng = random.Random(seed)
+    results = {}
+    for size in sizes:
+        try:
+            tree = generate_tree(int(size), seed=seed)
+            users = list(tree.members) + tree.outsiders
+            rows = list(tree.entities.values())
+            pairs = [(rng.choice(rows), rng.choice(users)) for _ in range(samples)]
+            pages = [
+                (rng.sample(rows, min(page_size, len(rows))), rng.choice(users))
+                for _ in range(samples)
+            ]
+            frappe.local.conf.drive_disable_access_cache = True
+            results[size] = {
+                "legacy_get_user_access": measure(legacy_get_user_access_as, pairs),
+                "compute_user_access": measure(compute_user_access, pairs),
+                "get_user_access_many": measure(get_user_access_many, pages),
+                "check_access_many": measure(
+                    check_access_many, [([r.name for r in p], "write", u) for p, u in pages]
+                ),
+            }
+            frappe.local.conf.drive_disable_access_cache = False
+            results[size]["get_user_access (cached)"] = measure(get_user_access, pairs * 2)
+        finally:
+            frappe.local.conf.drive_disable_access_cache = False
+            frappe.set_user("Administrator")
+            frappe.db.rollback()
+    return results
@@ -0,0 +1,149 @@
+import frappe
+from datetime import datetime
+from frappe.utils import now_datetime
+
+from drive.utils.cache import bump_generation
+
+# Shared by all the teams of a user: views in one team can push out the recents of another
+RECENTS_LIMIT = 100
+FLUSH_BATCH_SIZE = 100
+
+
+def get_recents_key(user):
+    return frappe.cache().make_key(f"drive:recents:{user}")
+
+
+def get_dirty_key():
+    return frappe.cache().make_key("drive:recents_dirty")
+
+
+def record_view(entity_name, user=None):
+    """
+    Move an entity to the top of the recents of a user.
+
+    Recents live in a sorted set capped at RECENTS_LIMIT entries across all of the user's teams,
+    scored by the time of the last view, and are written to Drive Entity Log in the background.
+    The flush is queued right away, as views are mostly recorded by requests which never commit;
+    the hourly flush only picks up the views of a failed job.
+    """
+    if not user:
+        user = frappe.session.user
+    load_recents(user)
+    key = get_recents_key(user)
+    with frappe.cache().pipeline() as pipe:
+        pipe.zadd(key, {entity_name: now_datetime().timestamp()})
+        pipe.zremrangebyrank(key, 0, -RECENTS_LIMIT - 1)
+        pipe.sadd(get_dirty_key(), user)
+        pipe.execute()
+    frappe.enqueue(
+        flush_recents,
+        queue="short",
+        job_id="drive_flush_recents",
+        deduplicate=True,
+    )
+
+
+def load_recents(user):
+    """
+    Fill the sorted set of a user from Drive Entity Log, if Redis lost it
+    """
+    key = get_recents_key(user)
+    # `exists` of the cache wrapper would make the key again
+    if frappe.cache().zcard(key):
+        return
+    logs = frappe.get_all(
+        "Drive Entity Log",
+        filters={"user": user},
+        fields=["entity_name", "last_interaction"],
+        order_by="last_interaction desc",
+        limit=RECENTS_LIMIT,
+    )
+    if logs:
+        frappe.cache().zadd(
+            key,
+            {l.entity_name: l.last_interaction.timestamp() for l in logs},
+            nx=True,
+        )
+
+
+def get_recents(user=None, after=None):
+    """
+    Recents of a user, most recent first.
+
+    :param after: Only return the entries after this (timestamp, entity name) pair
+    :return: List of (entity name, timestamp of the last view)
+    """
+    if not user:
+        user = frappe.session.user
+    load_recents(user)
+    recents = frappe.cache().zrevrange(get_recents_key(user), 0, -1, withscores=True)
+    recents = [(name.decode(), score) for name, score in recents]
+    if after:
+        recents = [(name, score) for name, score in recents if (score, name) < tuple(after)]
+    return recents
+
+
+def remove_recents(entity_names=None, user=None):
+    """
+    Remove entities from the recents of a user, or all of them if none are given
+    """
+    if not user:
+        user = frappe.session.user
+    key = get_recents_key(user)
+    if entity_names is None:
+        frappe.cache().delete(key)
+        frappe.db.delete("Drive Entity Log", {"user": user})
+    elif entity_names:
+        frappe.cache().zrem(key, *entity_names)
+        frappe.db.delete("Drive Entity Log", {"user": user, "entity_name": ["in", entity_names]})
+    bump_generation("user", user)
+
+
+def flush_recents():
+    """
+    Write the recents of the users who viewed files since the last flush to Drive Entity Log, and
+    trim their logs to RECENTS_LIMIT entries.
+    """
+    while users := frappe.cache().spop(get_dirty_key(), FLUSH_BATCH_SIZE):
+        for user in users:
+            flush_user_recents(user.decode())
+        frappe.db.commit()
+
+
+def flush_user_recents(user):
+    recents = {name: datetime.fromtimestamp(score) for name, score in get_recents(user)}
+    if not recents:
+        return
+    logs = {
+        l.entity_name: l
+        for l in frappe.get_all(
+            "Drive Entity Log",
+            filters={"user": user},
+            fields=["name", "entity_name", "last_interaction"],
+        )
+    }
+
+    new = []
+    now = now_datetime()
+    for entity_name, last_interaction in recents.items():
+        log = logs.pop(entity_name, None)
+        if not log:
+            new.append((entity_name, user, last_interaction, user, now, now))
+        elif log.last_interaction < last_interaction:
+            frappe.db.set_value(
+                "Drive Entity Log",
+                log.name,
+                "last_interaction",
+                last_interaction,
+                update_modified=False,
+            )
+    if new:
+        frappe.db.bulk_insert(
+            "Drive Entity Log",
+            ["entity_name", "user", "last_interaction", "owner", "creation", "modified"],
+            new,
+        )
+    # Whatever is left fell out of the capped set
+    if logs and len(recents) >= RECENTS_LIMIT:
+        frappe.db.delete("Drive Entity Log", {"name": ["in", [l.name for l in logs.values()]]})
+    bump_generation("user", user)
@@ -0,0 +1,55 @@
+import frappe
+
+# Redis hashes keyed by team and by user, see `get_team_members` and `get_user_teams`
+TEAM_MEMBERS_CACHE = "drive_team_members"
+USER_TEAMS_CACHE = "drive_user_teams"
+
+
+def get_team_members(team):
+    """
+    Return the access level of every member of a team, without loading the Drive Team document
+
+    :return: Dict mapping each member to their access level
+    """
+
+    def _get_team_members():
+        return dict(
+            frappe.get_all(
+                "Drive Team Member",
+                filters={"parenttype": "Drive Team", "parent": team},
+                fields=["user", "access_level"],
+                as_list=True,
+            )
+        )
+
+    return frappe.cache().hget(TEAM_MEMBERS_CACHE, team, generator=_get_team_members)
+
+
+def get_user_teams(user):
+    """
+    Return the names of the teams a user is a member of
+    """
+
+    def _get_user_teams():
+        return frappe.get_all(
+            "Drive Team Member",
+            filters={"parenttype": "Drive Team", "user": user},
+            pluck="parent",
+        )
+
+    return frappe.cache().hget(USER_TEAMS_CACHE, user, generator=_get_user_teams)
+
+
+def clear_team_cache(team, users=()):
+    """
+    Drop the cached members of a team and the cached teams of the given users, now and once the
+    transaction commits (so that a concurrent request cannot cache the old members meanwhile).
+    """
+
+    def clear():
+        frappe.cache().hdel(TEAM_MEMBERS_CACHE, team)
+        for user in users:
+            frappe.cache().hdel(USER_TEAMS_CACHE, user)
+
+    clear()
+    frappe.db.after_commit.add(clear)
@@ -0,0 +1,303 @@
+import os
+import json
+import time
+import hashlib
+import frappe
+import redis
+import xxhash
+from pathlib import Path
+
+from drive.utils.files import FileManager
+
+UPLOAD_CHUNK_SIZE = 20 * 1024 * 1024
+# Uploads are hashed per block as their chunks arrive, in any order, without reading the file
+# back: the content hash of a file is the SHA-256 of the SHA-256 digests of its 4 MiB blocks (the
+# scheme of Dropbox's content_hash), and its fast hash the same with XXH3-128. Hash objects can't
+# be carried over from one chunk request to the next, but block digests can.
+HASH_BLOCK_SIZE = 4 * 1024 * 1024
+# S3 multipart uploads are limited to 10,000 parts
+S3_MAX_PARTS = 10000
+PART_URL_BATCH_SIZE = 100
+UPLOAD_SESSION_TTL = 24 * 60 * 60
+FINALIZE_LOCK_TTL = 10 * 60
+
+
+def get_hash(key):
+    """
+    Read a hash written with the raw client (pipelines): `hgetall` of the cache wrapper would
+    make the key a second time and unpickle the values
+    """
+    return redis.Redis.hgetall(frappe.cache(), key)
+
+
+def get_sessions_key():
+    """
+    Sorted set of every open upload session, scored by the time of its last chunk
+    """
+    return frappe.cache().make_key("drive:upload_sessions")
+
+
+class UploadSession:
+    """
+    State of a chunked upload, shared by the requests of all its chunks.
+
+    Chunks may arrive in any order and concurrently: each one is written at its own offset of
+    the temp file, and marked as received in a Redis bitmap. The request which finds every
+    bit set takes the finalize lock and creates the Drive File.
+
+    Open sessions are registered in a sorted set, so that `reap_upload_sessions` can delete
+    the temp files of the ones which were never finished.
+    """
+
+    def __init__(self, uuid):
+        self.uuid = uuid
+        self.key = frappe.cache().make_key(f"drive:upload:{uuid}")
+
+    def create(self, path, file_size, chunk_size, total_chunks, **details):
+        """
+        Open the session, or refresh it if it already exists
+
+        :param path: Temp file the chunks are written to, empty when they go straight to S3
+        :param details: Anything else to keep with the session (team, parent, hash...)
+        """
+        meta = {
+            "owner": frappe.session.user,
+            "path": str(path),
+            "file_size": int(file_size),
+            "chunk_size": int(chunk_size),
+            "total_chunks": int(total_chunks),
+            **{k: v for k, v in details.items() if v is not None},
+        }
+        with frappe.cache().pipeline() as pipe:
+            pipe.hset(f"{self.key}:meta", mapping=meta)
+            pipe.expire(f"{self.key}:meta", UPLOAD_SESSION_TTL)
+            pipe.zadd(get_sessions_key(), {self.uuid: time.time()})
+            pipe.execute()
+
+    def get(self):
+        """
+        :return: Details the session was created with, or None if there is no open session
+        """
+        meta = get_hash(f"{self.key}:meta")
+        if not meta:
+            return None
+        meta = frappe._dict({k.decode(): v.decode() for k, v in meta.items()})
+        for field in ["file_size", "chunk_size", "total_chunks"]:
+            meta[field] = int(meta[field])
+        return meta
+
+    def write_chunk(self, path, offset, data):
+        """
+        Write a chunk at its offset of the temp file, without touching the other chunks
+        """
+        fd = os.open(path, os.O_WRONLY | os.O_CREAT, 0o644)
+        try:
+            view = memoryview(data)
+            while view:
+                written = os.pwrite(fd, view, offset)
+                view = view[written:]
+                offset += written
+        finally:
+            os.close(fd)
+
+    def mark_received(self, chunk_index, total_chunks):
+        """
+        Record a chunk as received
+
+        :return: True if every chunk of the upload has now been received
+        """
+        chunks_key = f"{self.key}:chunks"
+        with frappe.cache().pipeline() as pipe:
+            pipe.setbit(chunks_key, chunk_index, 1)
+            pipe.expire(chunks_key, UPLOAD_SESSION_TTL)
+            pipe.bitcount(chunks_key, 0, -1)
+            received = pipe.execute()[-1]
+        return received >= total_chunks
+
+    def get_received(self):
+        """
+        :return: Indexes of the chunks received so far
+        """
+        bitmap = frappe.cache().get(f"{self.key}:chunks") or b""
+        return [
+            i * 8 + bit
+            for i, byte in enumerate(bitmap)
+            for bit in range(8)
+            if byte & (0x80 >> bit)
+        ]
+
+    def add_digests(self, chunk_index, chunk_size, data):
+        """
+        Hash the blocks of a chunk, if chunks are aligned on blocks
+        """
+        if not chunk_size or int(chunk_size) % HASH_BLOCK_SIZE:
+            return
+        sha256, xxh = hash_blocks(data)
+        digests_key = f"{self.key}:digests"
+        with frappe.cache().pipeline() as pipe:
+            pipe.hset(digests_key, chunk_index, sha256 + xxh)
+            pipe.expire(digests_key, UPLOAD_SESSION_TTL)
+            pipe.execute()
+
+    def get_content_hash(self, total_chunks):
+        """
+        :return: Content hash and fast hash of the upload, or None if some chunks weren't hashed
+        """
+        digests = get_hash(f"{self.key}:digests")
+        digests = {int(i): d for i, d in digests.items()}
+        if len(digests) != total_chunks:
+            return None
+        sha256, xxh = [], []
+        for i in range(total_chunks):
+            # 32 bytes of SHA-256 and 16 of XXH3-128 for each block
+            blocks = len(digests[i]) // 48
+            sha256.append(digests[i][: blocks * 32])
+            xxh.append(digests[i][blocks * 32 :])
+        return combine_block_hashes(b"".join(sha256), b"".join(xxh))
+
+    def get_multipart(self):
+        """
+        :return: Dict with the name, S3 key and upload ID the chunks are streamed to, if any
+        """
+        multipart = frappe.cache().get(f"{self.key}:multipart")
+        return frappe._dict(json.loads(multipart)) if multipart else None
+
+    def set_multipart(self, name, s3_key, upload_id):
+        """
+        :return: False if a concurrent chunk already started the multipart upload
+        """
+        multipart = json.dumps({"name": name, "s3_key": s3_key, "upload_id": upload_id})
+        return bool(
+            frappe.cache().set(f"{self.key}:multipart", multipart, ex=UPLOAD_SESSION_TTL, nx=True)
+        )
+
+    def add_part(self, part_number, etag, size):
+        parts_key = f"{self.key}:parts"
+        with frappe.cache().pipeline() as pipe:
+            pipe.hset(parts_key, part_number, json.dumps({"ETag": etag, "Size": size}))
+            pipe.expire(parts_key, UPLOAD_SESSION_TTL)
+            pipe.execute()
+
+    def get_parts(self):
+        """
+        :return: ETag and size of the parts streamed to S3, by part number
+        """
+        parts = get_hash(f"{self.key}:parts")
+        return {int(n): json.loads(part) for n, part in parts.items()}
+
+    def acquire_finalize_lock(self):
+        """
+        :return: True for the single request allowed to finalize the upload
+        """
+        return bool(frappe.cache().set(f"{self.key}:lock", 1, ex=FINALIZE_LOCK_TTL, nx=True))
+
+    def release_finalize_lock(self):
+        frappe.cache().delete(f"{self.key}:lock")
+
+    def is_finalizing(self):
+        return frappe.cache().get(f"{self.key}:lock") is not None
+
+    def set_file(self, name):
+        """
+        Remember the Drive File an upload was finalized into, for chunks retried afterwards, and
+        close the session
+        """
+        with frappe.cache().pipeline() as pipe:
+            pipe.set(f"{self.key}:file", name, ex=UPLOAD_SESSION_TTL)
+            pipe.delete(*self.get_state_keys())
+            pipe.zrem(get_sessions_key(), self.uuid)
+            pipe.execute()
+
+    def get_state_keys(self):
+        return [f"{self.key}:{k}" for k in ["meta", "chunks", "multipart", "parts", "digests"]]
+
+    def get_file(self):
+        name = frappe.cache().get(f"{self.key}:file")
+        return name.decode() if name else None
+
+    def abort(self):
+        """
+        Close the session and delete whatever was received
+        """
+        meta = self.get()
+        multipart = meta if meta and meta.get("upload_id") else self.get_multipart()
+        if multipart:
+            FileManager().abort_multipart_upload(multipart.s3_key, multipart.upload_id)
+        elif meta and meta.path:
+            Path(meta.path).unlink(missing_ok=True)
+        with frappe.cache().pipeline() as pipe:
+            pipe.delete(*self.get_state_keys(), f"{self.key}:lock")
+            pipe.zrem(get_sessions_key(), self.uuid)
+            pipe.execute()
+
+
+def get_received_ranges(received, chunk_size, file_size):
+    """
+    Merge received chunk indexes into [start, end) byte ranges
+    """
+    ranges = []
+    for index in sorted(received):
+        start, end = index * chunk_size, min((index + 1) * chunk_size, file_size)
+        if ranges and ranges[-1][1] == start:
+            ranges[-1][1] = end
+        else:
+            ranges.append([start, end])
+    return ranges
+
+
+def hash_blocks(data):
+    """
+    :return: Concatenated SHA-256 and XXH3-128 digests of each HASH_BLOCK_SIZE block of data
+    """
+    sha256, xxh = [], []
+    view = memoryview(data)
+    for start in range(0, len(view), HASH_BLOCK_SIZE):
+        block = view[start : start + HASH_BLOCK_SIZE]
+        sha256.append(hashlib.sha256(block).digest())
+        xxh.append(xxhash.xxh3_128_digest(block))
+    return b"".join(sha256), b"".join(xxh)
+
+
+def combine_block_hashes(sha256, xxh):
+    """
+    :return: Content hash and fast hash of a file, from the digests of all of its blocks
+    """
+    return hashlib.sha256(sha256).hexdigest(), xxhash.xxh3_128_hexdigest(xxh)
+
+
+def get_file_hash(path):
+    """
+    Hash a file on disk with the same scheme as `UploadSession.add_digests`, for uploads whose
+    chunks were not aligned on blocks
+
+    :return: Content hash and fast hash of the file
+    """
+    sha256, xxh = [], []
+    with open(path, "rb") as f:
+        while block := f.read(HASH_BLOCK_SIZE):
+            digests = hash_blocks(block)
+            sha256.append(digests[0])
+            xxh.append(digests[1])
+    return combine_block_hashes(b"".join(sha256), b"".join(xxh))
+
+
+def reap_upload_sessions():
+    """
+    Delete the upload sessions idle for UPLOAD_SESSION_TTL along with their temp files, and
+    any temp file left in an uploads folder for that long without a session (e.g. from before
+    sessions were tracked, or if Redis lost them).
+    """
+    # Epoch seconds, like the scores of the sessions and the modification times of the files
+    cutoff = time.time() - UPLOAD_SESSION_TTL
+    for uuid in frappe.cache().zrangebyscore(get_sessions_key(), "-inf", cutoff):
+        session = UploadSession(uuid.decode())
+        if not session.is_finalizing():
+            session.abort()
+
+    for uploads_path in Path(frappe.get_site_path("private/files")).glob("*/uploads"):
+        for path in uploads_path.iterdir():
+            try:
+                if path.is_file() and path.stat().st_mtime < cutoff:
+                    path.unlink()
+            except FileNotFoundError:
+                pass
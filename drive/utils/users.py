@@ -1,8 +1,8 @@
 import frappe
 from frappe.rate_limiter import rate_limit
-from frappe.utils import now
 import requests
 import os
+from drive.utils.recents import record_view
 
 
 def mark_as_viewed(entity):
@@ -14,21 +14,7 @@ def mark_as_viewed(entity):
         return
     if entity.is_group:
         return
-    entity_name = entity.name
-    entity_log = frappe.db.get_value(
-        "Drive Entity Log", {"entity_name": entity_name, "user": frappe.session.user}
-    )
-    if entity_log:
-        frappe.db.set_value(
-            "Drive Entity Log", entity_log, "last_interaction", now(), update_modified=False
-        )
-        return
-    doc = frappe.new_doc("Drive Entity Log")
-    doc.entity_name = entity_name
-    doc.user = frappe.session.user
-    doc.last_interaction = now()
-    doc.insert()
-    return doc
+    record_view(entity.name)
 
 
 @frappe.whitelist(allow_guest=True)
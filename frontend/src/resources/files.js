@@ -1,4 +1,4 @@
-import { createResource } from "frappe-ui"
+import { call, createResource } from "frappe-ui"
 import { toast } from "@/utils/toasts"
 import { openEntity, setTitle } from "@/utils/files"
 
@@ -25,7 +25,42 @@ export const COMMON_OPTIONS = {
   },
 }
 
-export const getHome = createResource({
+// Listings come a page at a time: the resource keeps the cursor of the next page, which
+// `fetchNextPage` appends to its rows
+export const createListing = (options) => {
+  const transform = options.transform || ((rows) => rows)
+  const resource = createResource({
+    ...options,
+    transform(page) {
+      resource.nextCursor = page.next_cursor
+      return transform(page.files)
+    },
+  })
+  resource.fetchNextPage = async () => {
+    const params = resource.params
+    const cursor = resource.nextCursor
+    if (!cursor) return
+    // Until this page arrives, so that it is only fetched once
+    resource.nextCursor = null
+    let page
+    try {
+      page = await call(options.url, { ...params, cursor })
+    } catch {
+      resource.nextCursor = cursor
+      return
+    }
+    // Refetched in the meantime, e.g. in another order
+    if (resource.params !== params) return
+    resource.nextCursor = page.next_cursor
+    resource.setData((rows) => rows.concat(transform(page.files)))
+  }
+  resource.fetchAllPages = async () => {
+    while (resource.nextCursor) await resource.fetchNextPage()
+  }
+  return resource
+}
+
+export const getHome = createListing({
   ...COMMON_OPTIONS,
   url: "drive.api.list.files",
   makeParams: (params) => {
@@ -46,7 +81,7 @@ export const getTeams = createResource({
   cache: "teams",
 })
 
-export const getRecents = createResource({
+export const getRecents = createListing({
   ...COMMON_OPTIONS,
   url: "drive.api.list.files",
   cache: "recents-folder-contents",
@@ -55,7 +90,7 @@ export const getRecents = createResource({
   },
 })
 
-export const getPersonal = createResource({
+export const getPersonal = createListing({
   ...COMMON_OPTIONS,
   url: "drive.api.list.files",
   cache: "personal-folder-contents",
@@ -64,7 +99,7 @@ export const getPersonal = createResource({
   },
 })
 
-export const getFavourites = createResource({
+export const getFavourites = createListing({
   ...COMMON_OPTIONS,
   url: "drive.api.list.files",
   cache: "favourite-folder-contents",
@@ -73,7 +108,7 @@ export const getFavourites = createResource({
   },
 })
 
-export const getShared = createResource({
+export const getShared = createListing({
   ...COMMON_OPTIONS,
   url: "drive.api.list.shared",
   cache: "shared-folder-contents",
@@ -82,7 +117,7 @@ export const getShared = createResource({
   },
 })
 
-export const getTrash = createResource({
+export const getTrash = createListing({
   ...COMMON_OPTIONS,
   url: "drive.api.list.files",
   cache: "trash-folder-contents",
@@ -118,7 +153,7 @@ export const updateMoved = (new_parent, team) => {
   if (new_parent && team) {
     // All details are repetetively provided (check Folder.vue) because if this is run first
     // No further mutation of the resource object can take place
-    createResource({
+    createListing({
       ...COMMON_OPTIONS,
       url: "drive.api.list.files",
       makeParams: (params) => ({
@@ -290,16 +325,20 @@ export const move = createResource({
   },
 })
 
-export const allFolders = createResource({
+export const allFolders = createListing({
   method: "GET",
   url: "drive.api.list.files",
   cache: "all-folders",
+  // Every folder of the team, for the folder pickers
+  onSuccess: () => allFolders.fetchAllPages(),
   makeParams: (params) => ({
     ...params,
     is_active: 1,
     folders: 1,
     personal: -1,
     only_parent: 0,
+    fields: JSON.stringify(["name", "title", "parent_entity", "is_private"]),
+    include: JSON.stringify([]),
   }),
   transform: (d) =>
     d.map((k) => ({
@@ -7,7 +7,8 @@ import store from "@/store"
 
 export async function uploadDriveEntity(file, team, doc_name) {
   const fileUuid = uuidv4()
-  const chunkSize = 5 * 1024 * 1024 // size of each chunk (5MB)
+  // Multiple of the 4MB blocks uploads are hashed by, and at least the 5MB S3 parts need
+  const chunkSize = 8 * 1024 * 1024 // size of each chunk (8MB)
   let chunkByteOffset = 0
   let chunkIndex = 0
   const totalChunks = Math.ceil(file.size / chunkSize)
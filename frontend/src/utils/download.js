@@ -5,6 +5,9 @@ import html2pdf from "html2pdf.js"
 import editorStyle from "@/components/DocEditor/editor.css?inline"
 import globalStyle from "@/index.css?inline"
 
+// Folders are downloaded a page of children at a time
+const PAGE_LENGTH = 1000
+
 async function getPdfFromDoc(entity_name) {
   const res = await fetch(
     `/api/method/drive.api.files.get_file_content?entity_name=${entity_name}`
@@ -157,10 +160,11 @@ function get_file_content(entity_name) {
   })
 }
 
-function get_children(team, entity_name) {
-  const url =
+function get_children(team, entity_name, cursor = null) {
+  let url =
     "/api/method/" +
-    `drive.api.list.files?team=${team}&entity_name=${entity_name}`
+    `drive.api.list.files?team=${team}&entity_name=${entity_name}&limit=${PAGE_LENGTH}`
+  if (cursor) url += `&cursor=${encodeURIComponent(cursor)}`
   return fetch(url, {
     method: "GET",
     headers: {
@@ -175,5 +179,11 @@ function get_children(team, entity_name) {
       }
       return response.json()
     })
-    .then((json) => json.message)
+    .then(({ message }) =>
+      message.next_cursor
+        ? get_children(team, entity_name, message.next_cursor).then((rest) =>
+            message.files.concat(rest)
+          )
+        : message.files
+    )
 }
@@ -0,0 +1,95 @@
+/* Upload a file straight to the S3 bucket with presigned part URLs,
+   so that its contents never go through the Frappe server
+*/
+
+const PARALLEL_PARTS = 6
+
+export async function uploadToS3(
+  file,
+  { team, parent, personal },
+  onProgress,
+  signal
+) {
+  const upload = await call("create_s3_upload", {
+    team,
+    parent,
+    personal,
+    filename: file.name,
+    file_size: file.size,
+    mime_type: file.type,
+    last_modified: file.lastModified,
+  })
+  const urls = upload.urls
+  const parts = Array.from({ length: upload.total_parts }, (_, i) => i + 1)
+  const loaded = {}
+
+  try {
+    const next = async () => {
+      while (parts.length && !signal?.aborted) {
+        const n = parts.shift()
+        if (!urls[n]) {
+          const batch = [n, ...parts.slice(0, 99)]
+          Object.assign(
+            urls,
+            await call("get_s3_part_urls", {
+              uuid: upload.uuid,
+              part_numbers: JSON.stringify(batch),
+            })
+          )
+        }
+        const start = (n - 1) * upload.part_size
+        await putPart(
+          urls[n],
+          file.slice(start, start + upload.part_size),
+          (bytes) => {
+            loaded[n] = bytes
+            const total = Object.values(loaded).reduce((a, b) => a + b, 0)
+            if (onProgress) onProgress((total / file.size) * 100, total)
+          },
+          signal
+        )
+      }
+    }
+    await Promise.all(Array.from({ length: PARALLEL_PARTS }, next))
+    if (signal?.aborted) throw new Error("Upload canceled by user")
+  } catch (e) {
+    await call("abort_upload_session", { uuid: upload.uuid })
+    throw e
+  }
+  return await call("complete_s3_upload", { uuid: upload.uuid })
+}
+
+function putPart(url, blob, onProgress, signal) {
+  return new Promise((resolve, reject) => {
+    const xhr = new XMLHttpRequest()
+    signal?.addEventListener("abort", () => xhr.abort())
+    xhr.onabort = () => reject(new Error("Upload canceled by user"))
+    xhr.open("PUT", url)
+    xhr.upload.onprogress = (e) => onProgress(e.loaded)
+    xhr.onload = () =>
+      xhr.status < 300
+        ? resolve()
+        : reject(new Error(`Part upload failed: ${xhr.statusText}`))
+    xhr.onerror = () => reject(new Error("Part upload failed"))
+    xhr.send(blob)
+  })
+}
+
+async function call(method, params) {
+  const response = await fetch(
+    window.location.origin + `/api/method/drive.api.files.${method}`,
+    {
+      method: "POST",
+      body: JSON.stringify(params),
+      headers: {
+        "X-Frappe-CSRF-Token": window.csrf_token,
+        Accept: "application/json",
+        "Content-Type": "application/json",
+      },
+    }
+  )
+  if (!response.ok) {
+    throw new Error(`Upload failed: ${response.statusText}`)
+  }
+  return (await response.json()).message
+}